@@ -0,0 +1,197 @@
+"""Online-Backups der Datenbank: komprimiert, mit Zeitstempel und Aufbewahrung
+
+Kopiert wird mit der Backup-API von sqlite3 in Schritten zu BACKUP_SEITEN_PRO_SCHRITT
+Seiten mit kurzer Pause dazwischen, die Datenbank ist also nie lange gesperrt.
+Schreibt ein anderer Prozess während der Kopie, beginnt SQLite sie von vorne; nach
+BACKUP_MAX_NEUSTARTS Neustarts wird in einem einzigen Schritt kopiert (eine
+Lesetransaktion, die im WAL-Modus keine Schreiber blockiert). Prüfen
+(PRAGMA integrity_check) und Komprimieren laufen auf der Kopie, nicht auf der
+Datenbank der App.
+"""
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
+
+# Seiten pro Backup-Schritt (bei 4 KB pro Seite: 4 MB) und Pause zwischen den Schritten
+BACKUP_SEITEN_PRO_SCHRITT = 1024
+BACKUP_PAUSE = 0.005
+# Neustarts durch gleichzeitige Schreibzugriffe, danach in einem Schritt kopieren
+BACKUP_MAX_NEUSTARTS = 3
+# gzip-Stufe: 1 ist bei Datenbanken kaum grösser als 6, aber rund dreimal so schnell
+BACKUP_GZIP_STUFE = 1
+# Fortschrittsmeldung höchstens alle N Sekunden
+BACKUP_MELDE_INTERVALL = 2
+
+# <name>-YYYYMMDD-HHMMSS-ffffff.db.gz (ältere Backups ohne Mikrosekunden)
+BACKUP_MUSTER = re.compile(r'^(?P<name>.+)-(?P<zeit>\d{8}-\d{6})(?:-(?P<mikro>\d{6}))?\.db\.gz$')
+
+class BackupFehler(Exception):
+    """Backup unvollständig oder beschädigt"""
+
+class _ZuVieleNeustarts(Exception):
+    pass
+
+def _melde(text):
+    print(text, file=sys.stderr, flush=True)
+
+def _kopiere(quelle, ziel, melde, seiten=BACKUP_SEITEN_PRO_SCHRITT):
+    """Kopiert Datenbank quelle nach ziel (Verbindungen) mit der Backup-API"""
+    naechste_meldung = time.monotonic() + BACKUP_MELDE_INTERVALL
+    kopiert = neustarts = 0
+
+    def fortschritt(status, verbleibend, gesamt):
+        nonlocal naechste_meldung, kopiert, neustarts
+        if gesamt - verbleibend < kopiert:
+            neustarts += 1
+            if neustarts >= BACKUP_MAX_NEUSTARTS:
+                raise _ZuVieleNeustarts()
+        kopiert = gesamt - verbleibend
+        if time.monotonic() >= naechste_meldung:
+            melde(f"   {kopiert}/{gesamt} Seiten")
+            naechste_meldung = time.monotonic() + BACKUP_MELDE_INTERVALL
+        if verbleibend:
+            time.sleep(BACKUP_PAUSE)  # andere Verbindungen zwischen den Schritten zum Zug kommen lassen
+
+    try:
+        quelle.backup(ziel, pages=seiten, progress=fortschritt)
+    except _ZuVieleNeustarts:
+        melde(f"   {neustarts} Neustarts durch Schreibzugriffe, kopiere in einem Schritt")
+        quelle.backup(ziel)
+
+def _oeffne_lesend(pfad):
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(pfad))}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def pruefe_datei(pfad):
+    """PRAGMA integrity_check und Eckdaten einer (unkomprimierten) Datenbankdatei"""
+    conn = _oeffne_lesend(pfad)
+    try:
+        fehler = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        if fehler == ['ok']:
+            fehler = []
+        tabellen = {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        anzahl = {tabelle: conn.execute(f'SELECT COUNT(*) FROM {tabelle}').fetchone()[0]
+                  for tabelle in ('kunden', 'rapporte', 'rechnungen', 'schema_version') if tabelle in tabellen}
+    except sqlite3.DatabaseError as e:
+        fehler, anzahl = [str(e)], {}
+    finally:
+        conn.close()
+    return {'fehler': fehler, 'anzahl': anzahl}
+
+@contextmanager
+def entpackt(datei):
+    """Pfad einer unkomprimierten Kopie (temporär bei .gz, sonst die Datei selbst)"""
+    if not datei.endswith('.gz'):
+        yield datei
+        return
+    handle, temp = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(datei)))
+    try:
+        try:
+            with os.fdopen(handle, 'wb') as ziel, gzip.open(datei, 'rb') as quelle:
+                shutil.copyfileobj(quelle, ziel, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            raise BackupFehler(f"{datei} lässt sich nicht entpacken: {e}") from e
+        yield temp
+    finally:
+        os.remove(temp)
+
+def liste_backups(verzeichnis, name=None):
+    """Backups im Verzeichnis, neuestes zuerst: [{'datei', 'name', 'zeit', 'groesse'}]"""
+    if not os.path.isdir(verzeichnis):
+        return []
+    backups = []
+    for eintrag in os.scandir(verzeichnis):
+        treffer = BACKUP_MUSTER.match(eintrag.name)
+        if treffer and eintrag.is_file() and (name is None or treffer['name'] == name):
+            zeit = datetime.strptime(treffer['zeit'], '%Y%m%d-%H%M%S').replace(microsecond=int(treffer['mikro'] or 0))
+            backups.append({'datei': eintrag.path, 'name': treffer['name'], 'zeit': zeit,
+                            'groesse': eintrag.stat().st_size})
+    return sorted(backups, key=lambda b: b['zeit'], reverse=True)
+
+def raeume_auf(verzeichnis, name, anzahl):
+    """Löscht alle bis auf die neusten anzahl Backups (0: alle behalten)"""
+    if anzahl <= 0:
+        return []
+    alte = liste_backups(verzeichnis, name)[anzahl:]
+    for backup in alte:
+        os.remove(backup['datei'])
+    return [backup['datei'] for backup in alte]
+
+def erstelle_backup(datenbank, verzeichnis, anzahl=14, melde=_melde):
+    """Online-Backup der Datenbank als <name>-<zeit>.db.gz, geprüft, mit Aufbewahrung"""
+    os.makedirs(verzeichnis, exist_ok=True)
+    name = os.path.splitext(os.path.basename(datenbank))[0]
+    datei = os.path.join(verzeichnis, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db.gz")
+    # Eigene temporäre Dateien pro Aufruf: gleichzeitige Backups kommen sich nicht in die Quere
+    temps = []
+    for endung in ('.db.tmp', '.db.gz.tmp'):
+        handle, temp = tempfile.mkstemp(prefix=f"{name}-", suffix=endung, dir=verzeichnis)
+        os.close(handle)
+        temps.append(temp)
+    roh, gepackt = temps
+    start = time.perf_counter()
+    try:
+        quelle = sqlite3.connect(datenbank, timeout=5)
+        ziel = sqlite3.connect(roh)
+        try:
+            _kopiere(quelle, ziel, melde)
+            ziel.execute('PRAGMA journal_mode = DELETE')  # Backup ist eine einzelne Datei
+        finally:
+            ziel.close()
+            quelle.close()
+
+        pruefung = pruefe_datei(roh)
+        if pruefung['fehler']:
+            raise BackupFehler(f"Kopie fehlerhaft: {'; '.join(pruefung['fehler'][:5])}")
+
+        with open(roh, 'rb') as f, gzip.open(gepackt, 'wb', compresslevel=BACKUP_GZIP_STUFE) as gz:
+            shutil.copyfileobj(f, gz, 1024 * 1024)
+        # Nie ein bestehendes Backup ersetzen (os.link schlägt fehl, wenn datei existiert)
+        try:
+            os.link(gepackt, datei)
+        except FileExistsError:
+            raise BackupFehler(f"{datei} existiert bereits") from None
+    finally:
+        for temp in temps:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    return {'datei': datei, 'groesse': os.path.getsize(datei), 'dauer_s': round(time.perf_counter() - start, 2),
+            'anzahl': pruefung['anzahl'], 'geloescht': raeume_auf(verzeichnis, name, anzahl)}
+
+def pruefe_backup(datei):
+    """Entpackt ein Backup temporär und prüft es (siehe pruefe_datei)"""
+    with entpackt(datei) as pfad:
+        return pruefe_datei(pfad)
+
+def spiele_backup_zurueck(datei, datenbank, melde=_melde):
+    """Überschreibt den Inhalt der Datenbank mit einem geprüften Backup
+
+    Läuft über die Backup-API in die bestehende Datenbank, dadurch sehen auch
+    laufende Prozesse sofort den zurückgespielten Stand (kein Dateitausch unter
+    offenen Verbindungen). Schreiber warten während des Zurückspielens.
+    """
+    with entpackt(datei) as pfad:
+        pruefung = pruefe_datei(pfad)
+        if pruefung['fehler']:
+            raise BackupFehler(f"Backup fehlerhaft: {'; '.join(pruefung['fehler'][:5])}")
+        quelle = _oeffne_lesend(pfad)
+        ziel = sqlite3.connect(datenbank, timeout=30)
+        try:
+            # In einem Schritt: die Zieldatenbank bleibt ohnehin bis zum Ende gesperrt
+            _kopiere(quelle, ziel, melde, seiten=-1)
+        except sqlite3.OperationalError as e:
+            raise BackupFehler(f"Zurückspielen fehlgeschlagen: {e}") from e
+        finally:
+            ziel.close()
+            quelle.close()
+    return pruefung
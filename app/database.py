@@ -1,79 +1,139 @@
+import os
 import sqlite3
+import threading
 from flask import current_app, g
+from app.messung import MessVerbindung
+from app.migrationen import migriere
+
+# PRAGMAs für jede neue Verbindung
+VERBINDUNGS_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',      # Leser blockieren Schreiber nicht
+    'PRAGMA synchronous = NORMAL',    # in WAL sicher, deutlich weniger fsyncs
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',   # 256 MB
+    'PRAGMA cache_size = -16000',     # 16 MB Page-Cache pro Verbindung
+]
+
+class VerbindungsPool:
+    """Einfacher Pool wiederverwendbarer SQLite-Verbindungen (threadsicher)"""
+
+    def __init__(self, pfad, max_frei=8, factory=sqlite3.Connection):
+        self.pfad = pfad
+        self.max_frei = max_frei
+        self.factory = factory
+        self._frei = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.statistik = {'geoeffnet': 0, 'wiederverwendet': 0, 'geschlossen': 0, 'aktiv': 0}
+
+    def _oeffne(self):
+        """Öffnet neue Verbindung und setzt die PRAGMAs"""
+        conn = sqlite3.connect(
+            self.pfad,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,  # Verbindung wandert zwischen Request-Threads
+            factory=self.factory
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in VERBINDUNGS_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def hole(self):
+        """Gibt freie Verbindung aus dem Pool oder öffnet eine neue"""
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Nach fork(): geerbte Verbindungen nicht weiterverwenden
+                self._frei = []
+                self._pid = os.getpid()
+            conn = self._frei.pop() if self._frei else None
+            self.statistik['aktiv'] += 1
+            if conn is not None:
+                self.statistik['wiederverwendet'] += 1
+                return conn
+            self.statistik['geoeffnet'] += 1
+        return self._oeffne()
+
+    def zurueckgeben(self, conn, verwerfen=False):
+        """Gibt Verbindung zurück; offene Transaktionen werden zurückgerollt"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            verwerfen = True
+
+        with self._lock:
+            self.statistik['aktiv'] -= 1
+            if not verwerfen and os.getpid() == self._pid and len(self._frei) < self.max_frei:
+                self._frei.append(conn)
+                return
+            self.statistik['geschlossen'] += 1
+        conn.close()
+
+    def schliessen(self):
+        """Schliesst alle freien Verbindungen"""
+        with self._lock:
+            frei, self._frei = self._frei, []
+            self.statistik['geschlossen'] += len(frei)
+        for conn in frei:
+            conn.close()
+
+    def status(self):
+        """Pool-Statistik als Dict"""
+        with self._lock:
+            return dict(self.statistik, frei=len(self._frei), max_frei=self.max_frei)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool():
+    """Pool für die konfigurierte Datenbank (wird bei Bedarf angelegt)"""
+    pfad = current_app.config['DATABASE']
+    with _pools_lock:
+        pool = _pools.get(pfad)
+        if pool is None:
+            # Mit METRIKEN=1 messen die Verbindungen ihre Statements (siehe app/messung.py)
+            factory = MessVerbindung if current_app.config.get('METRIKEN') else sqlite3.Connection
+            pool = _pools[pfad] = VerbindungsPool(pfad, current_app.config.get('DB_POOL_GROESSE', 8), factory)
+        return pool
 
 def get_db():
-    """Hole oder erstelle Datenbankverbindung"""
+    """Hole Datenbankverbindung für den aktuellen Kontext aus dem Pool"""
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().hole()
+        if isinstance(g.db, MessVerbindung):
+            g.db.messung = g.get('messung')
     return g.db
 
+def get_lese_db():
+    """Verbindung für lange Lesezugriffe (Exporte, Auswertung): Lesekopie mit SNAPSHOT=1, sonst get_db()"""
+    snapshot = current_app.extensions.get('snapshot')
+    if snapshot is None:
+        return get_db()
+    if 'lese_db' not in g:
+        factory = MessVerbindung if current_app.config.get('METRIKEN') else sqlite3.Connection
+        g.lese_db = snapshot.verbindung(factory)
+        if isinstance(g.lese_db, MessVerbindung):
+            g.lese_db.messung = g.get('messung')
+    return g.lese_db
+
+def close_db(exception=None):
+    """Gibt Verbindung des aktuellen Kontexts an den Pool zurück, schliesst die der Lesekopie"""
+    lese_db = g.pop('lese_db', None)
+    if lese_db is not None:
+        lese_db.close()
+    db = g.pop('db', None)
+    if db is not None:
+        if isinstance(db, MessVerbindung):
+            db.messung = None
+        get_pool().zurueckgeben(db, verwerfen=exception is not None)
+
 def init_db():
-    """Initialisiere Datenbank mit Schema"""
-    db = get_db()
-    
-    # Kunden Tabelle
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS kunden (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT,
-            telefon TEXT,
-            adresse TEXT,
-            strasse TEXT,
-            hausnummer TEXT,
-            plz TEXT,
-            stadt TEXT,
-            it_infrastruktur TEXT,
-            stundensatz REAL DEFAULT 120.0,
-            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Login-Daten Tabelle
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS login_daten (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            kunde_id INTEGER NOT NULL,
-            geraet_typ TEXT NOT NULL,
-            beschreibung TEXT,
-            username TEXT,
-            passwort TEXT,
-            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (kunde_id) REFERENCES kunden (id)
-        )
-    ''')
-    
-    # Rapporte Tabelle
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS rapporte (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            kunde_id INTEGER NOT NULL,
-            datum DATE NOT NULL,
-            dauer_minuten INTEGER NOT NULL,
-            thema TEXT NOT NULL,
-            kosten REAL,
-            bezahlt BOOLEAN DEFAULT 0,
-            zahlungsart TEXT,
-            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (kunde_id) REFERENCES kunden (id)
-        )
-    ''')
-
-    # Rechnungen Tabelle
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS rechnungen (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            rechnungs_nummer TEXT UNIQUE NOT NULL,
-            kunde_id INTEGER NOT NULL,
-            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            betrag REAL NOT NULL,
-            rapport_ids TEXT NOT NULL,
-            FOREIGN KEY (kunde_id) REFERENCES kunden (id)
-        )
-    ''')
+    """Bringt das Datenbankschema auf den neusten Stand (siehe app/migrationen.py)"""
+    migriere(get_db())
 
-    db.commit()
+def abfrageplan(db, query, params=()):
+    """Liefert EXPLAIN QUERY PLAN einer Abfrage als Liste von Textzeilen"""
+    return [row['detail'] for row in db.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()]
@@ -0,0 +1,200 @@
+"""Hintergrund-Jobs: Warteschlange in SQLite, abgearbeitet von Worker-Threads
+
+Jeder Prozess (gunicorn-Worker) startet beim ersten Request eigene Worker-Threads,
+alternativ läuft `flask jobs-worker` als eigener Prozess. Ein Job wird mit einem
+einzigen UPDATE ... RETURNING übernommen, dadurch bekommt ihn genau ein Thread,
+auch über Prozesse hinweg. Ein externer Broker ist nicht nötig.
+"""
+import json
+import os
+import threading
+import time
+
+from app.database import get_db
+
+# Registrierte Job-Arten: art -> funktion(parameter, job_id) -> {'datei', 'dateiname', 'mimetype'}
+JOB_ARTEN = {}
+
+def job_art(name):
+    """Dekorator: registriert eine Funktion als Job-Art"""
+    def registrieren(funktion):
+        JOB_ARTEN[name] = funktion
+        return funktion
+    return registrieren
+
+def job_einreihen(art, parameter):
+    """Legt einen wartenden Job an und gibt seine ID zurück"""
+    if art not in JOB_ARTEN:
+        raise ValueError(f"Unbekannte Job-Art: {art}")
+    db = get_db()
+    cursor = db.execute('INSERT INTO jobs (art, parameter) VALUES (?, ?)',
+                        (art, json.dumps(parameter, sort_keys=True)))
+    db.commit()
+    return cursor.lastrowid
+
+def lade_job(job_id):
+    return get_db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+def lade_jobs(anzahl=50):
+    """Neueste Jobs für die Übersicht"""
+    return get_db().execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (anzahl,)).fetchall()
+
+def _prozess_laeuft(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobWorker:
+    """Worker-Threads eines Prozesses, die wartende Jobs aus der Tabelle jobs abarbeiten"""
+
+    def __init__(self, app, verzeichnis, threads=1, intervall=2.0, max_laufzeit=3600, aufbewahrung_tage=7,
+                 pruef_intervall=60):
+        self.app = app
+        self.verzeichnis = verzeichnis
+        self.threads = threads
+        self.intervall = intervall
+        self.max_laufzeit = max_laufzeit
+        self.aufbewahrung_tage = aufbewahrung_tage
+        self.pruef_intervall = pruef_intervall
+        self._pid = None
+        self._lock = threading.Lock()
+        self._signal = threading.Event()
+        # IDs der Jobs, die dieser Prozess gerade ausführt (Übernahme und Prüfung unter _laufende_lock)
+        self._laufende = set()
+        self._laufende_lock = threading.Lock()
+
+    def sicherstellen(self):
+        """Startet die Worker-Threads in diesem Prozess (einmal pro Prozess, auch nach fork)"""
+        if self._pid == os.getpid() or self.threads <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._signal = threading.Event()
+            self._laufende = set()
+            for nummer in range(self.threads):
+                threading.Thread(target=self.arbeite, name=f'job-worker-{nummer}', daemon=True).start()
+
+    def benachrichtigen(self):
+        """Weckt wartende Worker-Threads dieses Prozesses (andere Prozesse pollen)"""
+        self._signal.set()
+
+    def arbeite(self):
+        """Endlosschleife: Jobs holen und ausführen, sonst bis zum nächsten Signal warten"""
+        naechste_pruefung = 0
+        while True:
+            try:
+                with self.app.app_context():
+                    if time.monotonic() >= naechste_pruefung:
+                        # Jobs abgestürzter Prozesse (z.B. von gunicorn neu gestartete Worker)
+                        self._verwaiste_zuruecksetzen()
+                        naechste_pruefung = time.monotonic() + self.pruef_intervall
+                    job = self._naechster_job()
+                    if job is not None:
+                        self._ausfuehren(job)
+                        continue
+            except Exception:
+                self.app.logger.exception('Job-Worker: Fehler beim Abarbeiten der Warteschlange')
+            self._signal.wait(self.intervall)
+            self._signal.clear()
+
+    def _naechster_job(self):
+        db = get_db()
+        with self._laufende_lock:
+            job = db.execute(
+                "UPDATE jobs SET status = 'laeuft', gestartet_am = CURRENT_TIMESTAMP, worker_pid = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'wartend' ORDER BY id LIMIT 1) "
+                "RETURNING *",
+                (os.getpid(),)
+            ).fetchone()
+            db.commit()
+            if job is not None:
+                self._laufende.add(job['id'])
+        return job
+
+    def _ausfuehren(self, job):
+        try:
+            self._ausfuehren_und_melden(job)
+        finally:
+            # Erst nach dem Commit des Status: vorher gälte der Job als verwaist
+            with self._laufende_lock:
+                self._laufende.discard(job['id'])
+
+    def _ausfuehren_und_melden(self, job):
+        db = get_db()
+        try:
+            funktion = JOB_ARTEN.get(job['art'])
+            if funktion is None:
+                raise ValueError(f"Unbekannte Job-Art: {job['art']}")
+            ergebnis = funktion(json.loads(job['parameter']), job['id'])
+        except Exception as e:
+            self.app.logger.exception('Job %s (%s) fehlgeschlagen', job['id'], job['art'])
+            if db.in_transaction:
+                db.rollback()
+            db.execute(
+                "UPDATE jobs SET status = 'fehler', beendet_am = CURRENT_TIMESTAMP, fehler = ? WHERE id = ?",
+                (str(e) or e.__class__.__name__, job['id'])
+            )
+        else:
+            db.execute(
+                "UPDATE jobs SET status = 'fertig', beendet_am = CURRENT_TIMESTAMP, "
+                "datei = ?, dateiname = ?, mimetype = ? WHERE id = ?",
+                (ergebnis['datei'], ergebnis['dateiname'], ergebnis['mimetype'], job['id'])
+            )
+        db.commit()
+        self._aufraeumen(db)
+
+    def _verwaiste_zuruecksetzen(self):
+        """Jobs beendeter Prozesse wieder einreihen, zu lange laufende als Fehler abschliessen
+
+        Wieder eingereiht wird nur, wenn der Job sicher nicht mehr ausgeführt wird: sein Prozess
+        läuft nicht mehr, oder es ist dieser Prozess (gleiche PID nach einem Neustart) und keiner
+        seiner Threads führt ihn aus. Sonst liefe derselbe Job zweimal.
+        """
+        db = get_db()
+        with self._laufende_lock:
+            laufende = db.execute(
+                "SELECT id, worker_pid, gestartet_am < datetime('now', ?) as abgelaufen "
+                "FROM jobs WHERE status = 'laeuft'",
+                (f'-{self.max_laufzeit} seconds',)
+            ).fetchall()
+            eigene = set(self._laufende)
+        for job in laufende:
+            pid = job['worker_pid']
+            if pid == os.getpid():
+                verwaist = job['id'] not in eigene
+            else:
+                verwaist = not pid or not _prozess_laeuft(pid)
+            if verwaist:
+                db.execute("UPDATE jobs SET status = 'wartend', worker_pid = NULL "
+                           "WHERE id = ? AND status = 'laeuft'", (job['id'],))
+            elif job['abgelaufen']:
+                # Prozess läuft noch (oder die PID wurde neu vergeben): nicht erneut ausführen
+                db.execute("UPDATE jobs SET status = 'fehler', beendet_am = CURRENT_TIMESTAMP, fehler = ? "
+                           "WHERE id = ? AND status = 'laeuft'",
+                           (f"Zeitüberschreitung: läuft länger als {self.max_laufzeit} s", job['id']))
+        db.commit()
+
+    def _aufraeumen(self, db):
+        """Beendete Jobs nach der Aufbewahrungsfrist samt Ergebnisdatei im Job-Verzeichnis löschen"""
+        alte = db.execute(
+            "SELECT id, datei FROM jobs WHERE status IN ('fertig', 'fehler') AND beendet_am < datetime('now', ?)",
+            (f'-{self.aufbewahrung_tage} days',)
+        ).fetchall()
+        if not alte:
+            return
+        verzeichnis = os.path.abspath(self.verzeichnis)
+        for job in alte:
+            # Rechnungs-PDFs liegen im Rechnungsarchiv und bleiben erhalten
+            if job['datei'] and os.path.dirname(os.path.abspath(job['datei'])) == verzeichnis:
+                try:
+                    os.remove(job['datei'])
+                except FileNotFoundError:
+                    pass
+        db.executemany('DELETE FROM jobs WHERE id = ?', [(job['id'],) for job in alte])
+        db.commit()
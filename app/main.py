@@ -1,14 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, Response, make_response
+from flask import Flask, render_template, request, redirect, url_for, Response, send_file, send_from_directory, abort, stream_with_context, jsonify
 from flask_httpauth import HTTPBasicAuth
 from werkzeug.security import check_password_hash
-from app.database import init_db, get_db
+from app.database import init_db, get_db, get_lese_db, close_db, get_pool, abfrageplan
+from app.migrationen import migrations_status, migriere
+from app.backup import BackupFehler, erstelle_backup, liste_backups, pruefe_backup, spiele_backup_zurueck
+from app.saldo import baue_salden_neu, pruefe_salden
+from app.messung import aktiviere_messung, messe_abschnitt
+from app.profiler import PdfProfiler
+from app.seiten_cache import SeitenCache
+from app.snapshot import Snapshot
+from app.jobs import JobWorker, job_art, job_einreihen, lade_job, lade_jobs
+from app.rapport_import import ImportFehler, lese_csv, lese_json, importiere_rapporte
+from app.rechnung_vorlage import (
+    STYLES, SEITENRAENDER, absender_kopf, POSITIONEN_STIL, OFFENE_POSITIONEN_STIL,
+    BEZAHLTE_POSITIONEN_STIL, ZUSAMMENFASSUNG_STIL, EXPORT_STIL, EXPORT_BLOCK_STIL, NachladendeFlowables
+)
 import os
 import csv
+import json
+import hashlib
+import hmac
+import tempfile
+import time
+import threading
+import click
 from io import StringIO, BytesIO
-from reportlab.lib import colors
+from functools import lru_cache
+from itertools import chain
+from collections import OrderedDict
+from markupsafe import Markup, escape
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer, PageBreak
 from reportlab.lib.units import cm
 from datetime import datetime
 from qrbill import QRBill
@@ -16,7 +38,42 @@ from svglib.svglib import svg2rlg
 
 app = Flask(__name__)
 app.config['DATABASE'] = os.environ.get('DATABASE_PATH', '/app/data/rapporte.db')
-app.config['TEMPLATES_AUTO_RELOAD'] = True
+# Templates nur im Debug-Modus bei jeder Änderung neu laden
+app.config['TEMPLATES_AUTO_RELOAD'] = os.environ.get('FLASK_DEBUG', '0') == '1'
+# Ablage der erzeugten Rechnungs-PDFs (inhaltsadressiert, neben der Datenbank)
+app.config['RECHNUNGEN_DIR'] = os.environ.get(
+    'RECHNUNGEN_DIR', os.path.join(os.path.dirname(app.config['DATABASE']), 'rechnungen'))
+# Ablage der cProfile-Ausgaben der PDF-Erstellung (siehe /admin/profile)
+app.config['PROFILE_DIR'] = os.environ.get(
+    'PROFILE_DIR', os.path.join(os.path.dirname(app.config['DATABASE']), 'profiles'))
+# Ergebnisdateien der Hintergrund-Jobs (Exporte)
+app.config['JOBS_DIR'] = os.environ.get(
+    'JOBS_DIR', os.path.join(os.path.dirname(app.config['DATABASE']), 'jobs'))
+# Ablage der komprimierten Online-Backups (`flask backup`)
+app.config['BACKUP_DIR'] = os.environ.get(
+    'BACKUP_DIR', os.path.join(os.path.dirname(app.config['DATABASE']), 'backups'))
+# Anzahl aufbewahrter Backups (0: alle behalten)
+app.config['BACKUP_ANZAHL'] = int(os.environ.get('BACKUP_ANZAHL', 14))
+# Worker-Threads für Hintergrund-Jobs pro Prozess (0: nur über `flask jobs-worker`)
+app.config['JOB_THREADS'] = int(os.environ.get('JOB_THREADS', 1))
+# Aufbewahrung beendeter Jobs und ihrer Exportdateien in Tagen
+app.config['JOB_AUFBEWAHRUNG_TAGE'] = int(os.environ.get('JOB_AUFBEWAHRUNG_TAGE', 7))
+# Anzahl Rapporte pro Seite in der Übersicht
+app.config['SEITENGROESSE'] = int(os.environ.get('SEITENGROESSE', 100))
+# Anzahl gecachter Seiten pro Prozess (Übersicht, Kunden; 0: Cache aus)
+app.config['SEITEN_CACHE_GROESSE'] = int(os.environ.get('SEITEN_CACHE_GROESSE', 128))
+# Exporte und Auswertung lesen aus einer Lesekopie statt aus der Hauptdatenbank
+app.config['SNAPSHOT'] = os.environ.get('SNAPSHOT', '0') == '1'
+app.config['SNAPSHOT_DATEI'] = os.environ.get(
+    'SNAPSHOT_DATEI', os.path.splitext(app.config['DATABASE'])[0] + '-snapshot.db')
+# Maximales Alter der Lesekopie in Sekunden, nachdem sich Daten geändert haben
+app.config['SNAPSHOT_MAX_ALTER'] = int(os.environ.get('SNAPSHOT_MAX_ALTER', 300))
+# Maximale Anzahl freier Datenbankverbindungen im Pool
+app.config['DB_POOL_GROESSE'] = int(os.environ.get('DB_POOL_GROESSE', 8))
+# Request-Messung (SQL, Rendering, PDF) mit Server-Timing-Header und /metrics
+app.config['METRIKEN'] = os.environ.get('METRIKEN', '0') == '1'
+if app.config['METRIKEN']:
+    aktiviere_messung(app)
 
 # HTTP Basic Auth Setup
 auth = HTTPBasicAuth()
@@ -39,15 +96,59 @@ PAYEE_CONFIG = {
     'country': os.environ.get('PAYEE_COUNTRY', 'CH')
 }
 
+# Profiler für die nächsten N PDF-Erstellungen
+pdf_profiler = PdfProfiler(app.config['PROFILE_DIR'])
+
+# Worker-Threads für Hintergrund-Jobs (starten beim ersten Request im jeweiligen Prozess)
+job_worker = JobWorker(app, app.config['JOBS_DIR'], threads=app.config['JOB_THREADS'],
+                       aufbewahrung_tage=app.config['JOB_AUFBEWAHRUNG_TAGE'])
+
+# Gerenderte Seiten mit ETag; Datenstand liegt neben der Datenbank (für alle Prozesse)
+seiten_cache = SeitenCache(app.config['DATABASE'] + '-datenstand', groesse=app.config['SEITEN_CACHE_GROESSE'])
+
+# Lesekopie für Exporte und Auswertung (siehe get_lese_db)
+if app.config['SNAPSHOT']:
+    app.extensions['snapshot'] = Snapshot(app.config['DATABASE'], app.config['SNAPSHOT_DATEI'],
+                                          seiten_cache.datenstand, max_alter=app.config['SNAPSHOT_MAX_ALTER'])
+
+# Cache erfolgreich geprüfter Zugangsdaten, damit scrypt nur einmal pro Sitzung läuft.
+# Schlüssel ist ein HMAC der Zugangsdaten mit zufälligem Prozess-Geheimnis (kein Klartext).
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 900))
+AUTH_CACHE_GROESSE = int(os.environ.get('AUTH_CACHE_GROESSE', 64))
+_auth_cache_geheimnis = os.urandom(32)
+_auth_cache = OrderedDict()
+_auth_cache_lock = threading.Lock()
+
 @auth.verify_password
 def verify_password(username, password):
-    if username in users and check_password_hash(users.get(username), password):
+    schluessel = hmac.new(_auth_cache_geheimnis, f"{username}:{password}".encode('utf-8'),
+                          hashlib.sha256).digest()
+    jetzt = time.monotonic()
+
+    with _auth_cache_lock:
+        eintrag = _auth_cache.get(schluessel)
+        if eintrag and eintrag[1] > jetzt:
+            _auth_cache.move_to_end(schluessel)
+            return eintrag[0]
+
+    with messe_abschnitt('auth'):
+        gueltig = username in users and check_password_hash(users.get(username), password)
+    if gueltig:
+        with _auth_cache_lock:
+            _auth_cache[schluessel] = (username, jetzt + AUTH_CACHE_TTL)
+            _auth_cache.move_to_end(schluessel)
+            while len(_auth_cache) > AUTH_CACHE_GROESSE:
+                _auth_cache.popitem(last=False)
         return username
     return None
 
 # Initialisiere Datenbank beim Start
 with app.app_context():
     init_db()
+    # Migrationen oder zurückgespielte Sicherung: keine Seiten vom alten Stand ausliefern
+    seiten_cache.invalidieren()
+    # Verbindungen aus der Initialisierung nicht an Worker-Prozesse vererben (gunicorn preload)
+    get_pool().schliessen()
 
 def format_date_ch(date_str):
     """Konvertiert Datum zu CH-Format (DD.MM.YYYY)"""
@@ -62,19 +163,212 @@ def format_date_ch(date_str):
             return f"{parts[2]}.{parts[1]}.{parts[0]}"
     return date_str
 
-def generiere_rechnungsnummer():
-    """Generiert eindeutige Rechnungsnummer im Format RE-YYYYMMDD-XXXXX"""
-    db = get_db()
+def generiere_rechnungsnummer(db):
+    """Generiert eindeutige Rechnungsnummer im Format RE-YYYYMMDD-XXXXX
+
+    Zählt den Tageszähler atomar hoch (O(1)). Muss in einer Schreib-Transaktion
+    laufen, die auch die Rechnung einfügt (siehe reserviere_rechnung).
+    """
     today = datetime.now().strftime("%Y%m%d")
 
-    # Zähle Rechnungen von heute
-    count = db.execute(
-        "SELECT COUNT(*) as cnt FROM rechnungen WHERE rechnungs_nummer LIKE ?",
-        (f"RE-{today}-%",)
-    ).fetchone()['cnt']
+    nummer = db.execute(
+        'INSERT INTO rechnungs_zaehler (tag, letzte_nummer) VALUES (?, 1) '
+        'ON CONFLICT (tag) DO UPDATE SET letzte_nummer = letzte_nummer + 1 '
+        'RETURNING letzte_nummer',
+        (today,)
+    ).fetchone()['letzte_nummer']
+
+    return f"RE-{today}-{nummer:05d}"
+
+# Reservierung einer Rechnungsnummer bis zum PDF; danach gilt sie als abgebrochen
+# (Rendern dauert Sekunden, auch ein grosser Rechnungslauf nur Minuten)
+RESERVIERUNG_DAUER = '+60 minutes'
+
+def reserviere_rechnung(kunde_id, betrag, rapport_ids, eingabe_hash, art):
+    """Reserviert Rechnungsnummer und legt die Rechnung (noch ohne PDF) samt Positionen an
+
+    Nummer und Rechnungszeile entstehen in derselben BEGIN IMMEDIATE-Transaktion,
+    dadurch bleibt die Nummerierung auch bei parallelen Workern lückenlos.
+    Wiederverwendet wird eine Reservierung ohne PDF mit identischen Eingabedaten,
+    sonst eine abgebrochene des Kunden (freigegeben oder abgelaufen): sie bekommt
+    die neuen Daten, statt eine Nummer ohne Rechnung zu hinterlassen.
+    """
+    db = get_db()
+    if db.in_transaction:
+        db.commit()
+
+    rapport_ids_text = ','.join(str(i) for i in rapport_ids)
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        offen = db.execute(
+            'SELECT id, rechnungs_nummer FROM rechnungen WHERE eingabe_hash = ? AND pdf_hash IS NULL '
+            'ORDER BY id DESC LIMIT 1',
+            (eingabe_hash,)
+        ).fetchone()
+        if offen is None:
+            offen = db.execute(
+                "SELECT id, rechnungs_nummer FROM rechnungen WHERE kunde_id = ? AND pdf_hash IS NULL "
+                "AND (reserviert_bis IS NULL OR reserviert_bis < datetime('now')) ORDER BY id LIMIT 1",
+                (kunde_id,)
+            ).fetchone()
+        if offen is not None:
+            rechnungs_nummer, rechnung_id = offen['rechnungs_nummer'], offen['id']
+            db.execute(
+                "UPDATE rechnungen SET betrag = ?, rapport_ids = ?, eingabe_hash = ?, art = ?, "
+                "erstellt_am = CURRENT_TIMESTAMP, reserviert_bis = datetime('now', ?) WHERE id = ?",
+                (betrag, rapport_ids_text, eingabe_hash, art, RESERVIERUNG_DAUER, rechnung_id)
+            )
+            db.execute('DELETE FROM rechnung_positionen WHERE rechnung_id = ?', (rechnung_id,))
+        else:
+            rechnungs_nummer = generiere_rechnungsnummer(db)
+            rechnung_id = db.execute(
+                "INSERT INTO rechnungen (rechnungs_nummer, kunde_id, betrag, rapport_ids, eingabe_hash, art, "
+                "reserviert_bis) VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))",
+                (rechnungs_nummer, kunde_id, betrag, rapport_ids_text, eingabe_hash, art, RESERVIERUNG_DAUER)
+            ).lastrowid
+        db.executemany(
+            'INSERT INTO rechnung_positionen (rechnung_id, rapport_id) VALUES (?, ?)',
+            [(rechnung_id, rapport_id) for rapport_id in rapport_ids]
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return rechnungs_nummer
+
+def gib_rechnung_frei(rechnungs_nummer):
+    """Gibt die Reservierung nach fehlgeschlagenem Rendern frei (nächste Rechnung des Kunden übernimmt sie)"""
+    db = get_db()
+    if db.in_transaction:
+        db.rollback()
+    db.execute('UPDATE rechnungen SET reserviert_bis = NULL WHERE rechnungs_nummer = ? AND pdf_hash IS NULL',
+               (rechnungs_nummer,))
+    db.commit()
+
+def rechnungen_fuer_rapporte(rapport_ids):
+    """Rückwärtssuche: {rapport_id: [Rechnungsnummern mit PDF]} für die angegebenen Rapporte"""
+    ergebnis = {}
+    if not rapport_ids:
+        return ergebnis
+    platzhalter = ','.join('?' * len(rapport_ids))
+    rows = get_db().execute(
+        f'SELECT p.rapport_id, re.rechnungs_nummer FROM rechnung_positionen p '
+        f'JOIN rechnungen re ON re.id = p.rechnung_id '
+        f'WHERE p.rapport_id IN ({platzhalter}) AND re.pdf_hash IS NOT NULL ORDER BY re.id',
+        list(rapport_ids)
+    ).fetchall()
+    for row in rows:
+        ergebnis.setdefault(row['rapport_id'], []).append(row['rechnungs_nummer'])
+    return ergebnis
+
+def hinterlege_rechnung_pdf(rechnungs_nummer, pdf_bytes):
+    """Speichert PDF in der Ablage und verknüpft es mit der reservierten Rechnung"""
+    pdf_hash = speichere_rechnung_pdf(pdf_bytes)
+    db = get_db()
+    db.execute('UPDATE rechnungen SET pdf_hash = ? WHERE rechnungs_nummer = ?',
+               (pdf_hash, rechnungs_nummer))
+    db.commit()
+    # Übersicht zeigt die Rechnungsnummern der Rapporte
+    seiten_cache.invalidieren()
+    return pdf_hash
+
+def rechnung_dateiname(art, rechnungs_nummer):
+    """Download-Name einer Rechnung (gleich beim Erstellen und beim erneuten Download)"""
+    if art == 'konsolidiert':
+        return f"Rechnung_Konsolidiert_{rechnungs_nummer}.pdf"
+    return f"Rechnung_{rechnungs_nummer}.pdf"
+
+def rechnung_pdf_pfad(pdf_hash):
+    """Pfad eines gespeicherten Rechnungs-PDFs in der Ablage"""
+    return os.path.join(app.config['RECHNUNGEN_DIR'], pdf_hash[:2], f"{pdf_hash}.pdf")
+
+def speichere_rechnung_pdf(pdf_bytes):
+    """Legt PDF inhaltsadressiert ab (SHA-256) und gibt den Hash zurück"""
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    pfad = rechnung_pdf_pfad(pdf_hash)
+    if not os.path.exists(pfad):
+        os.makedirs(os.path.dirname(pfad), exist_ok=True)
+        # Atomar schreiben: erst temporäre Datei, dann umbenennen
+        fd, tmp_pfad = tempfile.mkstemp(dir=os.path.dirname(pfad), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_pfad, pfad)
+    return pdf_hash
+
+def berechne_eingabe_hash(art, rapporte, kunde):
+    """Fingerabdruck aller Daten, die in eine Rechnung einfliessen"""
+    daten = json.dumps([art, rapporte, kunde, PAYEE_CONFIG], sort_keys=True, default=str)
+    return hashlib.sha256(daten.encode('utf-8')).hexdigest()
+
+def finde_gespeicherte_rechnung(eingabe_hash):
+    """Sucht bereits erstellte Rechnung mit identischen Eingabedaten"""
+    row = get_db().execute(
+        'SELECT rechnungs_nummer, pdf_hash FROM rechnungen '
+        'WHERE eingabe_hash = ? AND pdf_hash IS NOT NULL ORDER BY id DESC LIMIT 1',
+        (eingabe_hash,)
+    ).fetchone()
+    if row and os.path.exists(rechnung_pdf_pfad(row['pdf_hash'])):
+        return row
+    return None
+
+def sende_rechnung_pdf(pdf_hash, dateiname):
+    """Liefert gespeichertes PDF mit ETag aus (304 bei If-None-Match)"""
+    return send_file(
+        rechnung_pdf_pfad(pdf_hash),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=dateiname,
+        etag=pdf_hash,
+        conditional=True,
+        max_age=0
+    )
+
+def lade_rechnungs_kunde(kunde_id):
+    """Lädt Kundendaten für Rechnungen als Dict (None falls unbekannt)"""
+    kunde_row = get_db().execute('SELECT * FROM kunden WHERE id = ?', (kunde_id,)).fetchone()
+    if not kunde_row:
+        return None
+
+    return {
+        'id': kunde_row['id'],
+        'name': kunde_row['name'],
+        'email': kunde_row['email'],
+        'strasse': kunde_row['strasse'],
+        'hausnummer': kunde_row['hausnummer'],
+        'plz': kunde_row['plz'],
+        'stadt': kunde_row['stadt']
+    }
+
+def lade_rechnungs_rapporte(kunde_id, von_datum='', bis_datum=''):
+    """Lädt Rapporte eines Kunden für konsolidierte Rechnung (optionaler Datumsfilter)"""
+    query = 'SELECT * FROM rapporte WHERE kunde_id = ?'
+    params = [kunde_id]
+
+    if von_datum:
+        query += ' AND datum >= ?'
+        params.append(von_datum)
+    if bis_datum:
+        query += ' AND datum <= ?'
+        params.append(bis_datum)
+
+    query += ' ORDER BY datum ASC'
 
-    return f"RE-{today}-{count+1:05d}"
+    rapporte = []
+    for row in get_db().execute(query, params).fetchall():
+        rapporte.append({
+            'id': row['id'],
+            'datum': row['datum'],
+            'dauer_minuten': row['dauer_minuten'],
+            'thema': row['thema'],
+            'kosten': row['kosten'] or 0,
+            'bezahlt': row['bezahlt'],
+            'zahlungsart': row['zahlungsart']
+        })
+    return rapporte
 
+@messe_abschnitt('qr')
+@pdf_profiler.profiliere
 def generiere_qr_rechnung(betrag, kunde, rechnungs_nummer):
     """Generiert Swiss QR Bill als ReportLab Drawing"""
 
@@ -110,7 +404,8 @@ def generiere_qr_rechnung(betrag, kunde, rechnungs_nummer):
             'country': 'CH'
         }
 
-    # QR Bill erstellen
+    # Kein Cache: die Rechnungsnummer steht im QR-Code und ist pro Rechnung eindeutig.
+    # Gerendert wird im Speicher (SVG -> Drawing), ohne temporäre Dateien.
     bill = QRBill(
         account=PAYEE_CONFIG['iban'],
         creditor=creditor_data,
@@ -120,34 +415,21 @@ def generiere_qr_rechnung(betrag, kunde, rechnungs_nummer):
         language='de'  # Deutsch für Schweizer Senioren
     )
 
-    # SVG generieren und zu Drawing konvertieren
-    from tempfile import NamedTemporaryFile
-    with NamedTemporaryFile(suffix='.svg', delete=False) as tmp:
-        bill.as_svg(tmp.name)
-        drawing = svg2rlg(tmp.name)
-
-    return drawing
+    svg = StringIO()
+    bill.as_svg(svg)
+    return svg2rlg(BytesIO(svg.getvalue().encode('utf-8')))
 
+@messe_abschnitt('pdf')
+@pdf_profiler.profiliere
 def erstelle_konsolidierte_rechnung_pdf(rapporte, kunde, rechnungs_nummer):
     """Erstellt konsolidierte Rechnung mit allen Rapporten eines Kunden"""
 
     buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        rightMargin=2*cm,
-        leftMargin=2*cm,
-        topMargin=2*cm,
-        bottomMargin=2*cm
-    )
-    elements = []
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, **SEITENRAENDER)
+    styles = STYLES
 
     # === HEADER / ABSENDER ===
-    elements.append(Paragraph(f'<b>{PAYEE_CONFIG["display_name"]}</b>', styles['Title']))
-    elements.append(Paragraph(PAYEE_CONFIG['address_line1'], styles['Normal']))
-    elements.append(Paragraph(PAYEE_CONFIG['address_line2'], styles['Normal']))
-    elements.append(Spacer(1, 1*cm))
+    elements = absender_kopf(PAYEE_CONFIG)
 
     # === KUNDE & RECHNUNG INFO ===
     heute = format_date_ch(datetime.now().strftime('%Y-%m-%d'))
@@ -211,19 +493,7 @@ def erstelle_konsolidierte_rechnung_pdf(rapporte, kunde, rechnungs_nummer):
         data.append(['', '', '', 'Zwischentotal:', f"{total_offen:.2f}"])
 
         table = Table(data, colWidths=[1.5*cm, 2.5*cm, 8*cm, 2.5*cm, 2.5*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#cc0000')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('ALIGN', (4, 0), (4, -1), 'RIGHT'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('GRID', (0, 0), (-1, -2), 1, colors.black),
-            ('LINEABOVE', (3, -1), (-1, -1), 2, colors.black),
-            ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold'),
-        ]))
+        table.setStyle(OFFENE_POSITIONEN_STIL)
         elements.append(table)
         elements.append(Spacer(1, 0.5*cm))
 
@@ -249,19 +519,7 @@ def erstelle_konsolidierte_rechnung_pdf(rapporte, kunde, rechnungs_nummer):
         data.append(['', '', '', 'Zwischentotal:', f"{total_bezahlt:.2f}"])
 
         table = Table(data, colWidths=[1.5*cm, 2.5*cm, 7*cm, 3.5*cm, 2.5*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#228B22')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('ALIGN', (4, 0), (4, -1), 'RIGHT'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('GRID', (0, 0), (-1, -2), 1, colors.black),
-            ('LINEABOVE', (3, -1), (-1, -1), 2, colors.black),
-            ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold'),
-        ]))
+        table.setStyle(BEZAHLTE_POSITIONEN_STIL)
         elements.append(table)
         elements.append(Spacer(1, 0.5*cm))
 
@@ -273,12 +531,7 @@ def erstelle_konsolidierte_rechnung_pdf(rapporte, kunde, rechnungs_nummer):
         ['Offener Betrag:', f"CHF {total_offen:.2f}"],
     ]
     zusammenfassung_table = Table(zusammenfassung_data, colWidths=[10*cm, 5*cm])
-    zusammenfassung_table.setStyle(TableStyle([
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('LINEABOVE', (0, -1), (-1, -1), 2, colors.black),
-        ('TOPPADDING', (0, -1), (-1, -1), 8),
-    ]))
+    zusammenfassung_table.setStyle(ZUSAMMENFASSUNG_STIL)
     elements.append(zusammenfassung_table)
     elements.append(Spacer(1, 1*cm))
 
@@ -308,26 +561,17 @@ def erstelle_konsolidierte_rechnung_pdf(rapporte, kunde, rechnungs_nummer):
     return buffer.getvalue()
 
 
+@messe_abschnitt('pdf')
+@pdf_profiler.profiliere
 def erstelle_rechnung_pdf(rapport, kunde, rechnungs_nummer):
     """Erstellt vollständige Rechnung mit QR Bill für einen Rapport"""
 
     buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        rightMargin=2*cm,
-        leftMargin=2*cm,
-        topMargin=2*cm,
-        bottomMargin=2*cm
-    )
-    elements = []
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, **SEITENRAENDER)
+    styles = STYLES
 
     # === HEADER / ABSENDER ===
-    elements.append(Paragraph(f'<b>{PAYEE_CONFIG["display_name"]}</b>', styles['Title']))
-    elements.append(Paragraph(PAYEE_CONFIG['address_line1'], styles['Normal']))
-    elements.append(Paragraph(PAYEE_CONFIG['address_line2'], styles['Normal']))
-    elements.append(Spacer(1, 1*cm))
+    elements = absender_kopf(PAYEE_CONFIG)
 
     # === KUNDE & RECHNUNG INFO ===
     heute = format_date_ch(datetime.now().strftime('%Y-%m-%d'))
@@ -381,19 +625,7 @@ def erstelle_rechnung_pdf(rapport, kunde, rechnungs_nummer):
     data.append(['', '', '', 'Total CHF:', f"{rapport['kosten']:.2f}"])
 
     table = Table(data, colWidths=[1.5*cm, 2.5*cm, 8*cm, 2.5*cm, 2.5*cm])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (4, 0), (4, -1), 'RIGHT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),  # Text oben ausrichten (für mehrzeilige Beschreibung)
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -2), 1, colors.black),
-        ('LINEABOVE', (3, -1), (-1, -1), 2, colors.black),
-        ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold'),  # Total-Zeile fett
-    ]))
+    table.setStyle(POSITIONEN_STIL)
 
     elements.append(table)
     elements.append(Spacer(1, 1*cm))
@@ -432,8 +664,191 @@ def erstelle_rechnung_pdf(rapport, kunde, rechnungs_nummer):
 
 app.jinja_env.filters['date_ch'] = format_date_ch
 
+# Anzahl Zeilen pro Block beim Streaming-Export
+EXPORT_BLOCKGROESSE = 500
+
+def erzeuge_csv(cursor):
+    """Erzeugt CSV blockweise aus einem Export-Cursor (konstanter Speicherbedarf)"""
+    si = StringIO()
+    writer = csv.writer(si, delimiter=';')
+    writer.writerow(['Datum', 'Kunde', 'Thema', 'Dauer (Min)', 'Kosten (CHF)', 'Bezahlt', 'Zahlungsart'])
+    yield si.getvalue()
+
+    while True:
+        rapporte = cursor.fetchmany(EXPORT_BLOCKGROESSE)
+        if not rapporte:
+            break
+
+        # Puffer wiederverwenden statt pro Block neu anzulegen
+        si.seek(0)
+        si.truncate()
+        writer.writerows([
+            format_date_ch(r['datum']),
+            r['kunde'],
+            r['thema'],
+            r['dauer_minuten'],
+            f"{r['kosten']:.2f}" if r['kosten'] else '0.00',
+            'Ja' if r['bezahlt'] else 'Nein',
+            r['zahlungsart'] or ''
+        ] for r in rapporte)
+        yield si.getvalue()
+
+# Grösse der Spool-Datei des PDF-Exports im Speicher, danach wird auf die Platte ausgelagert
+EXPORT_SPOOL_GROESSE = 8 * 1024 * 1024
+EXPORT_PDF_KOPF = ['Datum', 'Kunde', 'Thema', 'Dauer\n(Min)', 'Kosten\n(CHF)', 'Status']
+
+def _export_tabelle(zeilen, stil):
+    """Tabelle eines Seitenblocks; der Kopf wird bei Seitenumbrüchen wiederholt"""
+    table = Table([EXPORT_PDF_KOPF] + zeilen, colWidths=[2.5*cm, 3.5*cm, 6*cm, 2*cm, 2*cm, 2.5*cm], repeatRows=1)
+    table.setStyle(stil)
+    return table
+
+@lru_cache(maxsize=1)
+def _export_zeilenmasse():
+    """Höhe von Tabellenkopf, einzeiliger Zeile und jeder weiteren Textzeile (einmal gemessen)"""
+    probe = ['01.01.2026', 'Kunde', 'Thema', '60', '120.00', '⏳ Offen']
+    kopf = _export_tabelle([], EXPORT_BLOCK_STIL).wrap(0, 0)[1]
+    eine = _export_tabelle([probe], EXPORT_BLOCK_STIL).wrap(0, 0)[1] - kopf
+    zwei = _export_tabelle([probe[:2] + ['Thema\nZeile 2'] + probe[3:]], EXPORT_BLOCK_STIL).wrap(0, 0)[1] - kopf
+    return kopf, eine, zwei - eine
+
+def erzeuge_export_tabellen(cursor, platz_erste_seite, platz_seite):
+    """Tabellen für den PDF-Export, je eine pro Seite; die letzte trägt die Total-Zeile
+
+    Eine einzige grosse Tabelle teilt ReportLab mit überlinearem Aufwand. Die Zeilen
+    sind Text ohne Umbruch, ihre Höhe hängt nur von der Zeilenzahl ab, daher lässt
+    sich jede Seite vorab füllen und Zeit und Speicher bleiben linear.
+    """
+    kopf_hoehe, zeilen_hoehe, weitere_zeile = _export_zeilenmasse()
+    total_kosten = 0
+    block, platz, belegt = [], platz_erste_seite, kopf_hoehe
+    for rapporte in iter(lambda: cursor.fetchmany(EXPORT_BLOCKGROESSE), []):
+        for r in rapporte:
+            kosten = r['kosten'] or 0
+            total_kosten += kosten
+            status = f"✓ {r['zahlungsart']}" if r['bezahlt'] else '⏳ Offen'
+            thema = r['thema'][:30] + '...' if len(r['thema']) > 30 else r['thema']
+            hoehe = zeilen_hoehe + weitere_zeile * max(thema.count('\n'), (r['kunde'] or '').count('\n'))
+            if block and belegt + hoehe > platz:
+                yield _export_tabelle(block, EXPORT_BLOCK_STIL)
+                yield PageBreak()
+                block, platz, belegt = [], platz_seite, kopf_hoehe
+            block.append([
+                format_date_ch(r['datum']),
+                r['kunde'],
+                thema,
+                str(r['dauer_minuten']),
+                f"{kosten:.2f}",
+                status
+            ])
+            belegt += hoehe
+
+    # Summe (passt sie nicht mehr auf die Seite, teilt ReportLab den letzten Block)
+    block.append(['', '', '', '', f"Total: {total_kosten:.2f}", ''])
+    yield _export_tabelle(block, EXPORT_STIL)
+
+# Abfragen der Rapporte-Übersicht und Exporte (Filter via rapporte_filter)
+UEBERSICHT_SQL = 'SELECT r.*, k.name as kunde_name FROM rapporte r LEFT JOIN kunden k ON r.kunde_id = k.id WHERE 1=1'
+UEBERSICHT_SUMMEN_SQL = ('SELECT COUNT(*) as anzahl, COALESCE(SUM(r.kosten), 0) as total, '
+                         'COALESCE(SUM(CASE WHEN r.bezahlt THEN 0 ELSE r.kosten END), 0) as offen, '
+                         'COALESCE(SUM(r.dauer_minuten), 0) as minuten FROM rapporte r WHERE 1=1')
+EXPORT_SQL = 'SELECT r.datum, k.name as kunde, r.thema, r.dauer_minuten, r.kosten, r.bezahlt, r.zahlungsart FROM rapporte r LEFT JOIN kunden k ON r.kunde_id = k.id WHERE 1=1'
+# Salden aus kunden_saldo (Trigger auf rapporte) statt SUM über alle Rapporte pro Kunde
+KUNDEN_LISTE_SQL = (
+    'SELECT k.*, COALESCE(s.offen_rappen, 0) / 100.0 as offen_betrag, '
+    'COALESCE(s.bezahlt_rappen, 0) / 100.0 as bezahlt_betrag, '
+    'COALESCE(s.offen_minuten, 0) as offen_minuten, s.letzter_rapport '
+    'FROM kunden k LEFT JOIN kunden_saldo s ON s.kunde_id = k.id ORDER BY k.name'
+)
+KUNDE_RAPPORTE_SQL = 'SELECT * FROM rapporte WHERE kunde_id = ? ORDER BY datum DESC'
+
+def rapporte_filter(kunde_id, von_datum, bis_datum, bezahlt_filter, verrechnet_filter=''):
+    """Baut WHERE-Bedingungen für die Filter der Übersicht (Alias r für rapporte)"""
+    bedingung = ''
+    params = []
+
+    if kunde_id:
+        bedingung += ' AND r.kunde_id = ?'
+        params.append(kunde_id)
+    if von_datum:
+        bedingung += ' AND r.datum >= ?'
+        params.append(von_datum)
+    if bis_datum:
+        bedingung += ' AND r.datum <= ?'
+        params.append(bis_datum)
+    if bezahlt_filter == '1':
+        bedingung += ' AND r.bezahlt = 1'
+    elif bezahlt_filter == '0':
+        bedingung += ' AND r.bezahlt = 0'
+    # Verrechnet: (Anti-)Join über den Index auf rechnung_positionen.rapport_id; nur Rechnungen
+    # mit PDF zählen (reservierte Rechnungen, deren Erstellung fehlgeschlagen ist, haben keins)
+    if verrechnet_filter in ('0', '1'):
+        bedingung += (f" AND {'NOT ' if verrechnet_filter == '0' else ''}EXISTS ("
+                      'SELECT 1 FROM rechnung_positionen p JOIN rechnungen re ON re.id = p.rechnung_id '
+                      'WHERE p.rapport_id = r.id AND re.pdf_hash IS NOT NULL)')
+
+    return bedingung, params
+
+# Aggregat-Abfragen der Auswertung
+AUSWERTUNG_SUMMEN = ('COUNT(*) as anzahl, COALESCE(SUM(r.dauer_minuten), 0) as minuten, '
+                     'COALESCE(SUM(r.kosten), 0) as total, '
+                     'COALESCE(SUM(CASE WHEN r.bezahlt THEN r.kosten ELSE 0 END), 0) as bezahlt, '
+                     'COALESCE(SUM(CASE WHEN r.bezahlt THEN 0 ELSE r.kosten END), 0) as offen')
+AUSWERTUNG_SQL = {
+    'gesamt': f'SELECT {AUSWERTUNG_SUMMEN} FROM rapporte r',
+    'kunden': f'''
+        SELECT r.kunde_id, k.name as kunde_name, {AUSWERTUNG_SUMMEN}
+        FROM rapporte r LEFT JOIN kunden k ON r.kunde_id = k.id
+        GROUP BY r.kunde_id ORDER BY total DESC
+    ''',
+    'monate': f'''
+        SELECT substr(r.datum, 1, 7) as monat, {AUSWERTUNG_SUMMEN}
+        FROM rapporte r GROUP BY monat ORDER BY monat DESC
+    ''',
+    'zahlungsarten': f'''
+        SELECT CASE WHEN r.bezahlt THEN COALESCE(NULLIF(r.zahlungsart, ''), 'Unbekannt') ELSE 'Offen' END as zahlungsart,
+               {AUSWERTUNG_SUMMEN}
+        FROM rapporte r GROUP BY 1 ORDER BY total DESC
+    ''',
+}
+
+# Cache der Auswertung (pro Prozess): {'datenstand': ..., 'daten': ...}
+_auswertung_cache = {}
+
+def invalidiere_auswertung():
+    """Verwirft die gecachte Auswertung (nach Schreibzugriffen auf Rapporte/Kunden)"""
+    _auswertung_cache.clear()
+
+def daten_geaendert():
+    """Nach Schreibzugriffen (nach dem Commit): Auswertung und gecachte Seiten verwerfen"""
+    invalidiere_auswertung()
+    seiten_cache.invalidieren()
+
+def lade_auswertung():
+    """Liefert Auswertung aus dem Cache oder berechnet sie per GROUP BY neu"""
+    db = get_lese_db()
+    if 'snapshot' in app.extensions:
+        # Lesekopie: Datenstand, von dem sie kopiert wurde (bleibt bis zur Erneuerung gültig)
+        stand = db.execute('SELECT datenstand FROM snapshot_info').fetchone()['datenstand']
+    else:
+        # Datenstand vor dem Lesen: Änderungen anderer Prozesse verwerfen den Eintrag
+        stand = seiten_cache.datenstand()
+    eintrag = _auswertung_cache.get('auswertung')
+    if eintrag and eintrag['datenstand'] == stand:
+        return eintrag['daten']
+
+    daten = {
+        'gesamt': dict(db.execute(AUSWERTUNG_SQL['gesamt']).fetchone()),
+        'kunden': [dict(row) for row in db.execute(AUSWERTUNG_SQL['kunden']).fetchall()],
+        'monate': [dict(row) for row in db.execute(AUSWERTUNG_SQL['monate']).fetchall()],
+        'zahlungsarten': [dict(row) for row in db.execute(AUSWERTUNG_SQL['zahlungsarten']).fetchall()],
+    }
+    _auswertung_cache['auswertung'] = {'datenstand': stand, 'daten': daten}
+    return daten
+
 @app.route('/')
 @auth.login_required
+@seiten_cache.seite
 def index():
     """Hauptseite mit Übersicht der letzten Rapporte mit Filter"""
     db = get_db()
@@ -443,51 +858,106 @@ def index():
     von_datum = request.args.get('von_datum', '')
     bis_datum = request.args.get('bis_datum', '')
     bezahlt_filter = request.args.get('bezahlt', '')
+    verrechnet_filter = request.args.get('verrechnet', '')
     
-    # Base Query
-    query = 'SELECT r.*, k.name as kunde_name FROM rapporte r LEFT JOIN kunden k ON r.kunde_id = k.id WHERE 1=1'
-    params = []
-    
-    if kunde_id:
-        query += ' AND r.kunde_id = ?'
-        params.append(kunde_id)
-    if von_datum:
-        query += ' AND r.datum >= ?'
-        params.append(von_datum)
-    if bis_datum:
-        query += ' AND r.datum <= ?'
-        params.append(bis_datum)
-    if bezahlt_filter == '1':
-        query += ' AND r.bezahlt = 1'
-    elif bezahlt_filter == '0':
-        query += ' AND r.bezahlt = 0'
-    
-    query += ' ORDER BY r.datum DESC'
-    
-    rapporte = db.execute(query, params).fetchall()
+    # Seitengrösse und Cursor (datum_id des letzten Rapports der vorherigen Seite)
+    pro_seite = min(max(request.args.get('pro_seite', app.config['SEITENGROESSE'], type=int), 1), 500)
+    nach = request.args.get('nach', '')
+
+    bedingung, params = rapporte_filter(kunde_id, von_datum, bis_datum, bezahlt_filter, verrechnet_filter)
+
+    # Summen über alle gefilterten Rapporte (separate Aggregat-Abfrage über alle Treffer,
+    # darum nur auf der ersten Seite; Folgeseiten blättern nur im Index)
+    summen = None if nach else db.execute(UEBERSICHT_SUMMEN_SQL + bedingung, params).fetchone()
+
+    # Keyset-Pagination auf (datum, id): nur die aktuelle Seite laden
+    seiten_bedingung = ''
+    seiten_params = list(params)
+    if nach:
+        cursor_datum, _, cursor_id = nach.rpartition('_')
+        if cursor_datum and cursor_id.isdigit():
+            seiten_bedingung = ' AND (r.datum, r.id) < (?, ?)'
+            seiten_params += [cursor_datum, int(cursor_id)]
+    query = UEBERSICHT_SQL + bedingung + seiten_bedingung + ' ORDER BY r.datum DESC, r.id DESC LIMIT ?'
+
+    rapporte = db.execute(query, seiten_params + [pro_seite + 1]).fetchall()
     kunden = db.execute('SELECT id, name FROM kunden ORDER BY name').fetchall()
-    
-    # Formatiere Datum im Python-Code
-    rapporte_formatted = []
-    for r in rapporte:
-        r_dict = {}
-        for key in r.keys():
-            if key == 'datum':
-                r_dict[key] = format_date_ch(r[key])  # Überschreibe datum mit formatiertem Wert
-            else:
-                r_dict[key] = r[key]
-        rapporte_formatted.append(r_dict)
-    
-    return render_template('index.html', rapporte=rapporte_formatted, kunden=kunden,
-                         filters={'kunde_id': kunde_id, 'von_datum': von_datum, 
-                                'bis_datum': bis_datum, 'bezahlt': bezahlt_filter})
+
+    # Link zur nächsten Seite, falls weitere Rapporte vorhanden
+    filters = {'kunde_id': kunde_id, 'von_datum': von_datum,
+               'bis_datum': bis_datum, 'bezahlt': bezahlt_filter, 'verrechnet': verrechnet_filter}
+    naechste_seite = None
+    if len(rapporte) > pro_seite:
+        rapporte = rapporte[:pro_seite]
+        letzter = rapporte[-1]
+        naechste_seite = url_for('index', **{k: v for k, v in filters.items() if v},
+                                 pro_seite=request.args.get('pro_seite') or None,
+                                 nach=f"{letzter['datum']}_{letzter['id']}")
+
+    return render_template('index.html', rapporte=rapporte, kunden=kunden, summen=summen,
+                         rechnungen=rechnungen_fuer_rapporte([r['id'] for r in rapporte]),
+                         filters=filters, naechste_seite=naechste_seite, erste_seite=bool(nach))
+
+@app.route('/auswertung')
+@auth.login_required
+def auswertung():
+    """Umsatz-Auswertung pro Kunde, Monat und Zahlungsart"""
+    return render_template('auswertung.html', **lade_auswertung())
+
+# Markierung der Treffer in FTS5-highlight/snippet (Steuerzeichen, werden nach dem Escapen ersetzt)
+TREFFER_START, TREFFER_ENDE = '\x02', '\x03'
+
+def fts_abfrage(suchtext):
+    """Wandelt Benutzereingabe in FTS5-Abfrage um (Wörter als Präfix, UND-verknüpft)"""
+    woerter = [w.replace('"', '""') for w in suchtext.split()]
+    return ' '.join(f'"{w}"*' for w in woerter if w.strip('"'))
+
+def markiere_treffer(text):
+    """Escaped Text und ersetzt Treffer-Markierungen durch <mark>"""
+    text = str(escape(text or ''))
+    return Markup(text.replace(TREFFER_START, '<mark>').replace(TREFFER_ENDE, '</mark>').replace('\n', '<br>'))
+
+app.jinja_env.filters['treffer'] = markiere_treffer
+
+@app.route('/suche')
+@auth.login_required
+def suche():
+    """Volltextsuche über Rapport-Themen und Kunden (Name, IT-Infrastruktur)"""
+    suchtext = request.args.get('q', '').strip()
+    rapporte, kunden = [], []
+
+    abfrage = fts_abfrage(suchtext)
+    if abfrage:
+        db = get_db()
+        rapporte = db.execute('''
+            SELECT r.id, r.datum, r.kunde_id, r.dauer_minuten, r.bezahlt, k.name as kunde_name,
+                   snippet(rapporte_fts, 0, ?, ?, ' … ', 24) as treffer
+            FROM rapporte_fts
+            JOIN rapporte r ON r.id = rapporte_fts.rowid
+            LEFT JOIN kunden k ON k.id = r.kunde_id
+            WHERE rapporte_fts MATCH ?
+            ORDER BY rank
+            LIMIT 100
+        ''', (TREFFER_START, TREFFER_ENDE, abfrage)).fetchall()
+        kunden = db.execute('''
+            SELECT k.id, highlight(kunden_fts, 0, ?, ?) as name,
+                   snippet(kunden_fts, 1, ?, ?, ' … ', 24) as treffer
+            FROM kunden_fts
+            JOIN kunden k ON k.id = kunden_fts.rowid
+            WHERE kunden_fts MATCH ?
+            ORDER BY rank
+            LIMIT 50
+        ''', (TREFFER_START, TREFFER_ENDE, TREFFER_START, TREFFER_ENDE, abfrage)).fetchall()
+
+    return render_template('suche.html', suchtext=suchtext, rapporte=rapporte, kunden=kunden)
 
 @app.route('/kunden')
 @auth.login_required
+@seiten_cache.seite
 def kunden_liste():
-    """Liste aller Kunden"""
+    """Liste aller Kunden mit offenem Saldo"""
     db = get_db()
-    kunden = db.execute('SELECT * FROM kunden ORDER BY name').fetchall()
+    kunden = db.execute(KUNDEN_LISTE_SQL).fetchall()
     return render_template('kunden.html', kunden=kunden)
 
 @app.route('/kunden/neu', methods=['GET', 'POST'])
@@ -505,6 +975,7 @@ def kunde_neu():
              request.form['it_infrastruktur'], request.form.get('stundensatz', 120.0))
         )
         db.commit()
+        daten_geaendert()
         return redirect(url_for('kunden_liste'))
     return render_template('kunde_form.html')
 
@@ -533,12 +1004,48 @@ def rapport_neu():
              'bezahlt' in request.form, request.form.get('zahlungsart', ''))
         )
         db.commit()
+        daten_geaendert()
         return redirect(url_for('index'))
     
     db = get_db()
     kunden = db.execute('SELECT id, name, stundensatz FROM kunden ORDER BY name').fetchall()
     return render_template('rapport_form.html', kunden=kunden)
 
+def lese_importdaten(text, json_format):
+    """Rapporte aus JSON- oder CSV-Text (ImportFehler bei unlesbaren Daten)"""
+    if not text.strip():
+        raise ImportFehler("Datei leer")
+    return lese_json(text) if json_format else lese_csv(text)
+
+@app.route('/rapporte/import', methods=['GET', 'POST'])
+@auth.login_required
+def rapporte_import():
+    """Massenimport: Datei-Upload im Formular oder JSON/CSV als Request-Body (Antwort JSON)"""
+    if request.method == 'GET':
+        return render_template('rapport_import.html')
+
+    teilweise = request.values.get('teilweise') == '1'
+    nur_pruefen = request.values.get('pruefen') == '1'
+    datei = request.files.get('datei')
+    try:
+        if datei is not None:
+            zeilen = lese_importdaten(datei.read().decode('utf-8-sig'), datei.filename.lower().endswith('.json'))
+        else:
+            zeilen = lese_importdaten(request.get_data(as_text=True), request.is_json)
+    except (ImportFehler, UnicodeDecodeError) as e:
+        if datei is not None:
+            return render_template('rapport_import.html', fehler=str(e)), 400
+        return jsonify({'fehler': str(e)}), 400
+
+    ergebnis = importiere_rapporte(zeilen, teilweise=teilweise, nur_pruefen=nur_pruefen)
+    if ergebnis['importiert']:
+        daten_geaendert()
+
+    status = 422 if ergebnis['fehler'] and not ergebnis['importiert'] else 200
+    if datei is not None:
+        return render_template('rapport_import.html', ergebnis=ergebnis, nur_pruefen=nur_pruefen), status
+    return jsonify(ergebnis), status
+
 @app.route('/rapporte/<int:rapport_id>/bearbeiten', methods=['GET', 'POST'])
 @auth.login_required
 def rapport_bearbeiten(rapport_id):
@@ -562,6 +1069,7 @@ def rapport_bearbeiten(rapport_id):
              'bezahlt' in request.form, request.form.get('zahlungsart', ''), rapport_id)
         )
         db.commit()
+        daten_geaendert()
         return redirect(url_for('index'))
     
     rapport = db.execute('SELECT * FROM rapporte WHERE id = ?', (rapport_id,)).fetchone()
@@ -570,13 +1078,19 @@ def rapport_bearbeiten(rapport_id):
 
 @app.route('/kunden/<int:kunde_id>')
 @auth.login_required
+@seiten_cache.seite
 def kunde_detail(kunde_id):
     """Kundendetails mit Login-Daten und Rapporten"""
+    return kunde_detail_seite(kunde_id)
+
+def kunde_detail_seite(kunde_id, fehler=None):
     db = get_db()
     kunde = db.execute('SELECT * FROM kunden WHERE id = ?', (kunde_id,)).fetchone()
+    saldo = db.execute('SELECT * FROM kunden_saldo WHERE kunde_id = ?', (kunde_id,)).fetchone()
     logins = db.execute('SELECT * FROM login_daten WHERE kunde_id = ?', (kunde_id,)).fetchall()
-    rapporte = db.execute('SELECT * FROM rapporte WHERE kunde_id = ? ORDER BY datum DESC', (kunde_id,)).fetchall()
-    return render_template('kunde_detail.html', kunde=kunde, logins=logins, rapporte=rapporte)
+    rapporte = db.execute(KUNDE_RAPPORTE_SQL, (kunde_id,)).fetchall()
+    return render_template('kunde_detail.html', kunde=kunde, saldo=saldo, logins=logins, rapporte=rapporte,
+                           fehler=fehler)
 
 @app.route('/kunden/<int:kunde_id>/bearbeiten', methods=['GET', 'POST'])
 @auth.login_required
@@ -593,6 +1107,7 @@ def kunde_bearbeiten(kunde_id):
              request.form['it_infrastruktur'], request.form.get('stundensatz', 120.0), kunde_id)
         )
         db.commit()
+        daten_geaendert()
         return redirect(url_for('kunde_detail', kunde_id=kunde_id))
 
     kunde = db.execute('SELECT * FROM kunden WHERE id = ?', (kunde_id,)).fetchone()
@@ -611,6 +1126,7 @@ def login_neu(kunde_id):
              request.form['username'], request.form['passwort'])
         )
         db.commit()
+        daten_geaendert()
         return redirect(url_for('kunde_detail', kunde_id=kunde_id))
 
     db = get_db()
@@ -630,6 +1146,7 @@ def login_bearbeiten(login_id):
              request.form['username'], request.form['passwort'], login_id)
         )
         db.commit()
+        daten_geaendert()
         login = db.execute('SELECT kunde_id FROM login_daten WHERE id = ?', (login_id,)).fetchone()
         return redirect(url_for('kunde_detail', kunde_id=login['kunde_id']))
 
@@ -646,261 +1163,181 @@ def login_loeschen(login_id):
     kunde_id = login['kunde_id']
     db.execute('DELETE FROM login_daten WHERE id = ?', (login_id,))
     db.commit()
+    daten_geaendert()
     return redirect(url_for('kunde_detail', kunde_id=kunde_id))
 
 @app.route('/kunden/<int:kunde_id>/loeschen', methods=['POST'])
 @auth.login_required
 def kunde_loeschen(kunde_id):
-    """Kunde und alle zugehörigen Daten löschen"""
+    """Kunde samt Login-Daten und Rapporten löschen (nicht bei Kunden mit Rechnungen)"""
     db = get_db()
+    # Rechnungen sind Buchhaltungsbelege (lückenlose Nummern) und werden nie gelöscht, auch
+    # keine Positionen, die auf Rapporte dieses Kunden zeigen
+    verrechnet = db.execute(
+        'SELECT EXISTS (SELECT 1 FROM rechnungen WHERE kunde_id = ?) OR EXISTS ('
+        'SELECT 1 FROM rechnung_positionen p JOIN rapporte r ON r.id = p.rapport_id WHERE r.kunde_id = ?)',
+        (kunde_id, kunde_id)
+    ).fetchone()[0]
+    if verrechnet:
+        return kunde_detail_seite(
+            kunde_id, fehler='Kunde hat Rechnungen und kann nicht gelöscht werden.'), 409
+
     # Lösche zuerst abhängige Daten
     db.execute('DELETE FROM login_daten WHERE kunde_id = ?', (kunde_id,))
     db.execute('DELETE FROM rapporte WHERE kunde_id = ?', (kunde_id,))
     db.execute('DELETE FROM kunden WHERE id = ?', (kunde_id,))
     db.commit()
+    daten_geaendert()
     return redirect(url_for('kunden_liste'))
 
-@app.route('/export/csv')
-@auth.login_required
-def export_csv():
-    """Exportiere gefilterte Rapporte als CSV"""
-    db = get_db()
-    
-    # Gleiche Filter wie auf Hauptseite
-    kunde_id = request.args.get('kunde_id', '')
-    von_datum = request.args.get('von_datum', '')
-    bis_datum = request.args.get('bis_datum', '')
-    bezahlt_filter = request.args.get('bezahlt', '')
-    
-    query = 'SELECT r.datum, k.name as kunde, r.thema, r.dauer_minuten, r.kosten, r.bezahlt, r.zahlungsart FROM rapporte r LEFT JOIN kunden k ON r.kunde_id = k.id WHERE 1=1'
-    params = []
-    
-    if kunde_id:
-        query += ' AND r.kunde_id = ?'
-        params.append(kunde_id)
-    if von_datum:
-        query += ' AND r.datum >= ?'
-        params.append(von_datum)
-    if bis_datum:
-        query += ' AND r.datum <= ?'
-        params.append(bis_datum)
-    if bezahlt_filter == '1':
-        query += ' AND r.bezahlt = 1'
-    elif bezahlt_filter == '0':
-        query += ' AND r.bezahlt = 0'
-    
-    query += ' ORDER BY r.datum DESC'
-    rapporte = db.execute(query, params).fetchall()
-    
-    # CSV erstellen
-    si = StringIO()
-    writer = csv.writer(si, delimiter=';')
-    writer.writerow(['Datum', 'Kunde', 'Thema', 'Dauer (Min)', 'Kosten (CHF)', 'Bezahlt', 'Zahlungsart'])
-    
-    for r in rapporte:
-        writer.writerow([
-            format_date_ch(r['datum']),
-            r['kunde'],
-            r['thema'],
-            r['dauer_minuten'],
-            f"{r['kosten']:.2f}" if r['kosten'] else '0.00',
-            'Ja' if r['bezahlt'] else 'Nein',
-            r['zahlungsart'] or ''
-        ])
-    
-    output = si.getvalue()
-    si.close()
-    
-    response = Response(output, mimetype='text/csv')
-    response.headers['Content-Disposition'] = f'attachment; filename=rapporte_{datetime.now().strftime("%Y%m%d")}.csv'
-    return response
+EXPORT_FILTER = ('kunde_id', 'von_datum', 'bis_datum', 'bezahlt', 'verrechnet')
 
-@app.route('/export/pdf')
-@auth.login_required
-def export_pdf():
-    """Exportiere gefilterte Rapporte als PDF"""
-    db = get_db()
-    
-    # Gleiche Filter wie auf Hauptseite
-    kunde_id = request.args.get('kunde_id', '')
-    von_datum = request.args.get('von_datum', '')
-    bis_datum = request.args.get('bis_datum', '')
-    bezahlt_filter = request.args.get('bezahlt', '')
-    
-    query = 'SELECT r.datum, k.name as kunde, r.thema, r.dauer_minuten, r.kosten, r.bezahlt, r.zahlungsart FROM rapporte r LEFT JOIN kunden k ON r.kunde_id = k.id WHERE 1=1'
-    params = []
-    
-    if kunde_id:
-        query += ' AND r.kunde_id = ?'
-        params.append(kunde_id)
-    if von_datum:
-        query += ' AND r.datum >= ?'
-        params.append(von_datum)
-    if bis_datum:
-        query += ' AND r.datum <= ?'
-        params.append(bis_datum)
-    if bezahlt_filter == '1':
-        query += ' AND r.bezahlt = 1'
-    elif bezahlt_filter == '0':
-        query += ' AND r.bezahlt = 0'
-    
-    query += ' ORDER BY r.datum DESC'
-    rapporte = db.execute(query, params).fetchall()
-    
-    # PDF erstellen
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
+def export_filter(args):
+    """Filter der Hauptseite aus den Request-Argumenten (auch Parameter der Export-Jobs)"""
+    return {name: args.get(name, '') for name in EXPORT_FILTER}
+
+def export_cursor(filter_werte):
+    """Cursor über die gefilterten Rapporte für CSV- und PDF-Export"""
+    bedingung, params = rapporte_filter(filter_werte['kunde_id'], filter_werte['von_datum'],
+                                        filter_werte['bis_datum'], filter_werte['bezahlt'],
+                                        filter_werte['verrechnet'])
+    return get_lese_db().execute(EXPORT_SQL + bedingung + ' ORDER BY r.datum DESC', params)
+
+def export_dateiname(endung):
+    return f'rapporte_{datetime.now().strftime("%Y%m%d")}.{endung}'
+
+def schreibe_export_pdf(filter_werte, ausgabe):
+    """Schreibt das PDF der gefilterten Rapporte seitenweise in die Datei ausgabe"""
+    cursor = export_cursor(filter_werte)
+    doc = SimpleDocTemplate(ausgabe, pagesize=A4, **SEITENRAENDER)
     elements = []
     
-    styles = getSampleStyleSheet()
+    styles = STYLES
     title = Paragraph('<b>Rapporte Übersicht</b>', styles['Title'])
     elements.append(title)
     elements.append(Spacer(1, 0.5*cm))
     
     # Filter-Info
     filter_info = []
-    if von_datum:
-        filter_info.append(f"Von: {format_date_ch(von_datum)}")
-    if bis_datum:
-        filter_info.append(f"Bis: {format_date_ch(bis_datum)}")
+    if filter_werte['von_datum']:
+        filter_info.append(f"Von: {format_date_ch(filter_werte['von_datum'])}")
+    if filter_werte['bis_datum']:
+        filter_info.append(f"Bis: {format_date_ch(filter_werte['bis_datum'])}")
     if filter_info:
         elements.append(Paragraph(' | '.join(filter_info), styles['Normal']))
         elements.append(Spacer(1, 0.3*cm))
     
-    # Tabelle
-    data = [['Datum', 'Kunde', 'Thema', 'Dauer\n(Min)', 'Kosten\n(CHF)', 'Status']]
-    
-    total_kosten = 0
-    for r in rapporte:
-        kosten = r['kosten'] or 0
-        total_kosten += kosten
-        status = f"✓ {r['zahlungsart']}" if r['bezahlt'] else '⏳ Offen'
-        data.append([
-            format_date_ch(r['datum']),
-            r['kunde'],
-            r['thema'][:30] + '...' if len(r['thema']) > 30 else r['thema'],
-            str(r['dauer_minuten']),
-            f"{kosten:.2f}",
-            status
-        ])
-    
-    # Summe
-    data.append(['', '', '', '', f"Total: {total_kosten:.2f}", ''])
-    
-    table = Table(data, colWidths=[2.5*cm, 3.5*cm, 6*cm, 2*cm, 2*cm, 2.5*cm])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-        ('GRID', (0, 0), (-1, -2), 1, colors.black),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-    ]))
-    
-    elements.append(table)
-    doc.build(elements)
-    
-    buffer.seek(0)
-    response = make_response(buffer.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=rapporte_{datetime.now().strftime("%Y%m%d")}.pdf'
-    return response
+    # Tabellen entstehen erst, wenn platypus sie braucht (konstanter Speicher pro Seite)
+    platz_seite = doc.height - 12  # Frame-Innenabstand oben und unten (je 6pt)
+    platz_erste_seite = platz_seite - sum(
+        e.wrap(doc.width, doc.height)[1] + e.getSpaceBefore() + e.getSpaceAfter() for e in elements)
+    tabellen = erzeuge_export_tabellen(cursor, platz_erste_seite, platz_seite)
+    with messe_abschnitt('pdf'):
+        doc.build(NachladendeFlowables(chain(elements, tabellen)))
 
-@app.route('/rechnung/kunde/<int:kunde_id>/konsolidiert')
+@app.route('/export/csv')
 @auth.login_required
-def rechnung_konsolidiert(kunde_id):
-    """Erstellt konsolidierte Rechnung für alle Rapporte eines Kunden"""
-    db = get_db()
-
-    # Optional: Datumsfilter
-    von_datum = request.args.get('von_datum', '')
-    bis_datum = request.args.get('bis_datum', '')
-
-    # Lade Kunde
-    kunde_row = db.execute('SELECT * FROM kunden WHERE id = ?', (kunde_id,)).fetchone()
-    if not kunde_row:
-        return "Kunde nicht gefunden", 404
+def export_csv():
+    """Exportiere gefilterte Rapporte als CSV (?hintergrund=1: als Job)"""
+    # Gleiche Filter wie auf Hauptseite
+    filter_werte = export_filter(request.args)
+    if request.args.get('hintergrund'):
+        return starte_job('export_csv', filter_werte)
 
-    kunde = {
-        'id': kunde_row['id'],
-        'name': kunde_row['name'],
-        'email': kunde_row['email'],
-        'strasse': kunde_row['strasse'],
-        'hausnummer': kunde_row['hausnummer'],
-        'plz': kunde_row['plz'],
-        'stadt': kunde_row['stadt']
-    }
+    cursor = export_cursor(filter_werte)
 
-    # Lade Rapporte mit optionalem Datumsfilter
-    query = 'SELECT * FROM rapporte WHERE kunde_id = ?'
-    params = [kunde_id]
+    # CSV als Stream ausliefern: erster Block sofort, danach blockweise aus dem Cursor
+    response = Response(stream_with_context(erzeuge_csv(cursor)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={export_dateiname("csv")}'
+    return response
 
-    if von_datum:
-        query += ' AND datum >= ?'
-        params.append(von_datum)
-    if bis_datum:
-        query += ' AND datum <= ?'
-        params.append(bis_datum)
+@app.route('/export/pdf')
+@auth.login_required
+def export_pdf():
+    """Exportiere gefilterte Rapporte als PDF (aus Spool-Datei gestreamt; ?hintergrund=1: als Job)"""
+    # Gleiche Filter wie auf Hauptseite
+    filter_werte = export_filter(request.args)
+    if request.args.get('hintergrund'):
+        return starte_job('export_pdf', filter_werte)
 
-    query += ' ORDER BY datum ASC'
+    # PDF erstellen (grosse Exporte werden ab EXPORT_SPOOL_GROESSE auf die Platte ausgelagert)
+    ausgabe = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_GROESSE)
+    schreibe_export_pdf(filter_werte, ausgabe)
+    
+    ausgabe.seek(0)
+    return send_file(ausgabe, mimetype='application/pdf', as_attachment=True,
+                     download_name=export_dateiname('pdf'), conditional=False, etag=False)
+
+class RechnungsFehler(Exception):
+    """Rechnung kann nicht erstellt werden (Meldung und HTTP-Status für die Route)"""
+
+    def __init__(self, meldung, status):
+        super().__init__(meldung)
+        self.status = status
+
+def pruefe_konsolidierte_rechnung(kunde_id, von_datum='', bis_datum=''):
+    """Prüft vor dem Einreihen als Job, ob die konsolidierte Rechnung erstellt werden kann"""
+    if not lade_rechnungs_kunde(kunde_id):
+        raise RechnungsFehler("Kunde nicht gefunden", 404)
+    if not lade_rechnungs_rapporte(kunde_id, von_datum, bis_datum):
+        raise RechnungsFehler("Keine Rapporte für diesen Kunden im angegebenen Zeitraum gefunden", 404)
+    if not PAYEE_CONFIG['iban']:
+        raise RechnungsFehler("Fehler: IBAN nicht konfiguriert. Bitte PAYEE_IBAN in docker-compose.yml setzen.", 500)
 
-    rapport_rows = db.execute(query, params).fetchall()
+def erstelle_konsolidierte_rechnung(kunde_id, von_datum='', bis_datum=''):
+    """Erstellt (oder findet) die konsolidierte Rechnung eines Kunden, gibt (pdf_hash, dateiname) zurück"""
+    # Lade Kunde
+    kunde = lade_rechnungs_kunde(kunde_id)
+    if not kunde:
+        raise RechnungsFehler("Kunde nicht gefunden", 404)
 
-    if not rapport_rows:
-        return "Keine Rapporte für diesen Kunden im angegebenen Zeitraum gefunden", 404
+    # Lade Rapporte mit optionalem Datumsfilter
+    rapporte = lade_rechnungs_rapporte(kunde_id, von_datum, bis_datum)
 
-    rapporte = []
-    for row in rapport_rows:
-        rapporte.append({
-            'id': row['id'],
-            'datum': row['datum'],
-            'dauer_minuten': row['dauer_minuten'],
-            'thema': row['thema'],
-            'kosten': row['kosten'] or 0,
-            'bezahlt': row['bezahlt'],
-            'zahlungsart': row['zahlungsart']
-        })
+    if not rapporte:
+        raise RechnungsFehler("Keine Rapporte für diesen Kunden im angegebenen Zeitraum gefunden", 404)
 
     # Validierung
     if not PAYEE_CONFIG['iban']:
-        return "Fehler: IBAN nicht konfiguriert. Bitte PAYEE_IBAN in docker-compose.yml setzen.", 500
+        raise RechnungsFehler("Fehler: IBAN nicht konfiguriert. Bitte PAYEE_IBAN in docker-compose.yml setzen.", 500)
 
-    # Generiere Rechnungsnummer
-    rechnungs_nummer = generiere_rechnungsnummer()
+    # Unveränderte Daten: gespeicherte Rechnung erneut ausliefern
+    eingabe_hash = berechne_eingabe_hash('konsolidiert', rapporte, kunde)
+    vorhanden = finde_gespeicherte_rechnung(eingabe_hash)
+    if vorhanden:
+        return vorhanden['pdf_hash'], rechnung_dateiname('konsolidiert', vorhanden['rechnungs_nummer'])
 
     # Berechne Gesamtbetrag (nur offene)
     total_offen = sum(r['kosten'] for r in rapporte if not r['bezahlt'])
 
-    # Speichere Rechnung in DB
-    rapport_ids = ','.join(str(r['id']) for r in rapporte)
-    db.execute(
-        'INSERT INTO rechnungen (rechnungs_nummer, kunde_id, betrag, rapport_ids) VALUES (?, ?, ?, ?)',
-        (rechnungs_nummer, kunde_id, total_offen, rapport_ids)
-    )
-    db.commit()
+    # Reserviere Rechnungsnummer und speichere Rechnung in DB
+    rapport_ids = [r['id'] for r in rapporte]
+    rechnungs_nummer = reserviere_rechnung(kunde_id, total_offen, rapport_ids, eingabe_hash, 'konsolidiert')
 
     # Generiere PDF
     try:
         pdf_bytes = erstelle_konsolidierte_rechnung_pdf(rapporte, kunde, rechnungs_nummer)
     except Exception as e:
-        return f"Fehler beim Erstellen der Rechnung: {str(e)}", 500
+        gib_rechnung_frei(rechnungs_nummer)
+        raise RechnungsFehler(f"Fehler beim Erstellen der Rechnung: {str(e)}", 500) from e
 
-    # Rückgabe als Download
-    response = make_response(pdf_bytes)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=Rechnung_Konsolidiert_{rechnungs_nummer}.pdf'
-
-    return response
+    # Speichere PDF
+    pdf_hash = hinterlege_rechnung_pdf(rechnungs_nummer, pdf_bytes)
+    return pdf_hash, rechnung_dateiname('konsolidiert', rechnungs_nummer)
 
+def pruefe_einzelrechnung(rapport_id):
+    """Prüft vor dem Einreihen als Job, ob die Rechnung des Rapports erstellt werden kann"""
+    row = get_db().execute('SELECT r.kosten FROM rapporte r JOIN kunden k ON r.kunde_id = k.id WHERE r.id = ?',
+                           (rapport_id,)).fetchone()
+    if not row:
+        raise RechnungsFehler("Rapport nicht gefunden", 404)
+    if not PAYEE_CONFIG['iban']:
+        raise RechnungsFehler("Fehler: IBAN nicht konfiguriert. Bitte PAYEE_IBAN in docker-compose.yml setzen.", 500)
+    if not row['kosten'] or row['kosten'] <= 0:
+        raise RechnungsFehler("Fehler: Rapport hat keinen gültigen Betrag.", 400)
 
-@app.route('/rechnung/rapport/<int:rapport_id>')
-@auth.login_required
-def rechnung_einzeln(rapport_id):
-    """Erstellt Rechnung für einzelnen Rapport"""
+def erstelle_einzelrechnung(rapport_id):
+    """Erstellt (oder findet) die Rechnung eines einzelnen Rapports, gibt (pdf_hash, dateiname) zurück"""
     db = get_db()
 
     # Lade Rapport mit Kundendaten
@@ -914,7 +1351,7 @@ def rechnung_einzeln(rapport_id):
     ''', (rapport_id,)).fetchone()
 
     if not row:
-        return "Rapport nicht gefunden", 404
+        raise RechnungsFehler("Rapport nicht gefunden", 404)
 
     # Konvertiere zu Dicts für einfacheren Zugriff
     rapport = {
@@ -939,40 +1376,439 @@ def rechnung_einzeln(rapport_id):
 
     # Validierung
     if not PAYEE_CONFIG['iban']:
-        return "Fehler: IBAN nicht konfiguriert. Bitte PAYEE_IBAN in docker-compose.yml setzen.", 500
+        raise RechnungsFehler("Fehler: IBAN nicht konfiguriert. Bitte PAYEE_IBAN in docker-compose.yml setzen.", 500)
 
     if not rapport['kosten'] or rapport['kosten'] <= 0:
-        return "Fehler: Rapport hat keinen gültigen Betrag.", 400
+        raise RechnungsFehler("Fehler: Rapport hat keinen gültigen Betrag.", 400)
 
-    # Generiere Rechnungsnummer
-    rechnungs_nummer = generiere_rechnungsnummer()
+    # Unveränderte Daten: gespeicherte Rechnung erneut ausliefern
+    eingabe_hash = berechne_eingabe_hash('einzeln', rapport, kunde)
+    vorhanden = finde_gespeicherte_rechnung(eingabe_hash)
+    if vorhanden:
+        return vorhanden['pdf_hash'], rechnung_dateiname('einzeln', vorhanden['rechnungs_nummer'])
 
-    # Speichere Rechnung in DB
-    db.execute(
-        'INSERT INTO rechnungen (rechnungs_nummer, kunde_id, betrag, rapport_ids) VALUES (?, ?, ?, ?)',
-        (rechnungs_nummer, rapport['kunde_id'], rapport['kosten'], str(rapport_id))
-    )
-    db.commit()
+    # Reserviere Rechnungsnummer und speichere Rechnung in DB
+    rechnungs_nummer = reserviere_rechnung(rapport['kunde_id'], rapport['kosten'], [rapport_id], eingabe_hash,
+                                           'einzeln')
 
     # Generiere PDF
     try:
         pdf_bytes = erstelle_rechnung_pdf(rapport, kunde, rechnungs_nummer)
     except Exception as e:
-        return f"Fehler beim Erstellen der Rechnung: {str(e)}", 500
+        gib_rechnung_frei(rechnungs_nummer)
+        raise RechnungsFehler(f"Fehler beim Erstellen der Rechnung: {str(e)}", 500) from e
+
+    # Speichere PDF
+    pdf_hash = hinterlege_rechnung_pdf(rechnungs_nummer, pdf_bytes)
+    return pdf_hash, rechnung_dateiname('einzeln', rechnungs_nummer)
+
+@app.route('/rechnung/kunde/<int:kunde_id>/konsolidiert')
+@auth.login_required
+def rechnung_konsolidiert(kunde_id):
+    """Erstellt konsolidierte Rechnung für alle Rapporte eines Kunden (?hintergrund=1: als Job)"""
+    # Optional: Datumsfilter
+    von_datum = request.args.get('von_datum', '')
+    bis_datum = request.args.get('bis_datum', '')
+
+    if request.args.get('hintergrund'):
+        return starte_job('rechnung_konsolidiert',
+                          {'kunde_id': kunde_id, 'von_datum': von_datum, 'bis_datum': bis_datum},
+                          pruefung=lambda: pruefe_konsolidierte_rechnung(kunde_id, von_datum, bis_datum))
+
+    try:
+        pdf_hash, dateiname = erstelle_konsolidierte_rechnung(kunde_id, von_datum, bis_datum)
+    except RechnungsFehler as e:
+        return str(e), e.status
 
     # Rückgabe als Download
-    response = make_response(pdf_bytes)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=Rechnung_{rechnungs_nummer}.pdf'
+    return sende_rechnung_pdf(pdf_hash, dateiname)
 
-    return response
+
+@app.route('/rechnung/rapport/<int:rapport_id>')
+@auth.login_required
+def rechnung_einzeln(rapport_id):
+    """Erstellt Rechnung für einzelnen Rapport (?hintergrund=1: als Job)"""
+    if request.args.get('hintergrund'):
+        return starte_job('rechnung_einzeln', {'rapport_id': rapport_id},
+                          pruefung=lambda: pruefe_einzelrechnung(rapport_id))
+
+    try:
+        pdf_hash, dateiname = erstelle_einzelrechnung(rapport_id)
+    except RechnungsFehler as e:
+        return str(e), e.status
+
+    # Rückgabe als Download
+    return sende_rechnung_pdf(pdf_hash, dateiname)
+
+@app.route('/rechnungen/<nummer>.pdf')
+@auth.login_required
+def rechnung_download(nummer):
+    """Liefert gespeicherte Rechnung ohne erneutes Rendern aus"""
+    db = get_db()
+    row = db.execute(
+        'SELECT pdf_hash, art FROM rechnungen WHERE rechnungs_nummer = ?', (nummer,)
+    ).fetchone()
+    if not row or not row['pdf_hash'] or not os.path.exists(rechnung_pdf_pfad(row['pdf_hash'])):
+        abort(404)
+    return sende_rechnung_pdf(row['pdf_hash'], rechnung_dateiname(row['art'], nummer))
+
+# Hintergrund-Jobs: Ergebnisdateien der Exporte liegen in JOBS_DIR, Rechnungen im Rechnungsarchiv
+def job_datei(job_id, endung):
+    os.makedirs(app.config['JOBS_DIR'], exist_ok=True)
+    return os.path.join(app.config['JOBS_DIR'], f'job_{job_id}.{endung}')
+
+@job_art('export_pdf')
+def _job_export_pdf(parameter, job_id):
+    pfad = job_datei(job_id, 'pdf')
+    with open(pfad, 'wb') as ausgabe:
+        schreibe_export_pdf(parameter, ausgabe)
+    return {'datei': pfad, 'dateiname': export_dateiname('pdf'), 'mimetype': 'application/pdf'}
+
+@job_art('export_csv')
+def _job_export_csv(parameter, job_id):
+    pfad = job_datei(job_id, 'csv')
+    with open(pfad, 'w', encoding='utf-8', newline='') as ausgabe:
+        ausgabe.writelines(erzeuge_csv(export_cursor(parameter)))
+    return {'datei': pfad, 'dateiname': export_dateiname('csv'), 'mimetype': 'text/csv'}
+
+@job_art('rechnung_konsolidiert')
+def _job_rechnung_konsolidiert(parameter, job_id):
+    pdf_hash, dateiname = erstelle_konsolidierte_rechnung(
+        parameter['kunde_id'], parameter['von_datum'], parameter['bis_datum'])
+    return {'datei': rechnung_pdf_pfad(pdf_hash), 'dateiname': dateiname, 'mimetype': 'application/pdf'}
+
+@job_art('rechnung_einzeln')
+def _job_rechnung_einzeln(parameter, job_id):
+    pdf_hash, dateiname = erstelle_einzelrechnung(parameter['rapport_id'])
+    return {'datei': rechnung_pdf_pfad(pdf_hash), 'dateiname': dateiname, 'mimetype': 'application/pdf'}
+
+JOB_BEZEICHNUNGEN = {
+    'export_pdf': 'PDF-Export',
+    'export_csv': 'CSV-Export',
+    'rechnung_konsolidiert': 'Konsolidierte Rechnung',
+    'rechnung_einzeln': 'Einzelrechnung',
+}
+
+def json_gewuenscht():
+    """Client bevorzugt JSON (Accept: application/json) statt HTML"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def job_als_dict(job):
+    daten = {name: job[name] for name in ('id', 'art', 'status', 'fehler', 'dateiname')}
+    for name in ('erstellt_am', 'gestartet_am', 'beendet_am'):
+        daten[name] = job[name].isoformat(sep=' ') if job[name] else None
+    daten['parameter'] = json.loads(job['parameter'])
+    daten['status_url'] = url_for('job_status', job_id=job['id'])
+    if job['status'] == 'fertig':
+        daten['download_url'] = url_for('job_download', job_id=job['id'])
+    return daten
+
+def starte_job(art, parameter, pruefung=None):
+    """Job einreihen und auf die Statusseite weiterleiten (JSON-Clients: 202 mit Job-ID)
+
+    pruefung wirft RechnungsFehler, wenn der Job sicher fehlschlagen würde (z.B. unbekannter
+    Rapport); dann wird nichts eingereiht und die Meldung wie ohne Job zurückgegeben.
+    """
+    if pruefung is not None:
+        try:
+            pruefung()
+        except RechnungsFehler as e:
+            if json_gewuenscht():
+                return jsonify({'fehler': str(e)}), e.status
+            return str(e), e.status
+    job_id = job_einreihen(art, parameter)
+    job_worker.sicherstellen()
+    job_worker.benachrichtigen()
+    status_url = url_for('job_status', job_id=job_id)
+    if json_gewuenscht():
+        return jsonify({'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
+    return redirect(status_url)
+
+@app.before_request
+def _job_worker_starten():
+    # Worker-Threads pro Prozess erst nach dem fork der gunicorn-Worker starten
+    job_worker.sicherstellen()
+
+@app.route('/jobs')
+@auth.login_required
+def jobs_liste():
+    """Letzte Hintergrund-Jobs"""
+    return render_template('jobs.html', jobs=lade_jobs(), bezeichnungen=JOB_BEZEICHNUNGEN)
+
+@app.route('/jobs/<int:job_id>')
+@auth.login_required
+def job_status(job_id):
+    """Status eines Jobs als Seite (lädt bis zum Ende neu) oder als JSON"""
+    job = lade_job(job_id)
+    if not job:
+        abort(404)
+    if json_gewuenscht():
+        return jsonify(job_als_dict(job))
+    return render_template('job.html', job=job, bezeichnungen=JOB_BEZEICHNUNGEN)
+
+@app.route('/jobs/<int:job_id>/download')
+@auth.login_required
+def job_download(job_id):
+    """Ergebnis eines fertigen Jobs herunterladen"""
+    job = lade_job(job_id)
+    if not job or job['status'] != 'fertig' or not os.path.exists(job['datei']):
+        abort(404)
+    return send_file(job['datei'], mimetype=job['mimetype'], as_attachment=True,
+                     download_name=job['dateiname'])
+
+@app.cli.command('jobs-worker')
+def jobs_worker_command():
+    """Hintergrund-Jobs in diesem Prozess abarbeiten (z.B. mit JOB_THREADS=0 im Webserver)"""
+    click.echo(f"Job-Worker gestartet (PID {os.getpid()}), Abbruch mit Ctrl+C")
+    try:
+        job_worker.arbeite()
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command('rechnungslauf')
+@click.option('--von', 'von_datum', default='', help='Rapporte ab Datum (YYYY-MM-DD)')
+@click.option('--bis', 'bis_datum', default='', help='Rapporte bis Datum (YYYY-MM-DD)')
+@click.option('--ausgabe', 'ausgabe_dir', default=None, help='Zielverzeichnis für PDFs und ZIP')
+@click.option('--workers', type=int, default=None, help='Anzahl Prozesse (Standard: CPU-Anzahl)')
+def rechnungslauf_command(von_datum, bis_datum, ausgabe_dir, workers):
+    """Konsolidierte Rechnungen für alle Kunden mit offenen Rapporten erstellen"""
+    from app.rechnungslauf import fuehre_rechnungslauf
+
+    if not ausgabe_dir:
+        ausgabe_dir = os.path.join(os.path.dirname(app.config['DATABASE']), 'rechnungslauf',
+                                   datetime.now().strftime('%Y%m%d_%H%M%S'))
+    fuehre_rechnungslauf(von_datum, bis_datum, ausgabe_dir, workers=workers, melde=click.echo)
+
+@app.cli.command('rapporte-import')
+@click.argument('datei', type=click.Path(exists=True, dir_okay=False))
+@click.option('--teilweise', is_flag=True, help='Gültige Zeilen trotz fehlerhafter Zeilen importieren')
+@click.option('--pruefen', 'nur_pruefen', is_flag=True, help='Nur prüfen, nichts importieren')
+def rapporte_import_command(datei, teilweise, nur_pruefen):
+    """Rapporte aus einer JSON- oder CSV-Datei importieren"""
+    start = time.perf_counter()
+    with open(datei, encoding='utf-8-sig') as f:
+        try:
+            zeilen = lese_importdaten(f.read(), datei.lower().endswith('.json'))
+        except ImportFehler as e:
+            raise click.ClickException(str(e))
+        except UnicodeDecodeError as e:
+            raise click.ClickException(f"Datei ist nicht UTF-8-kodiert: {e}")
+
+    ergebnis = importiere_rapporte(zeilen, teilweise=teilweise, nur_pruefen=nur_pruefen)
+    if ergebnis['importiert']:
+        daten_geaendert()
+    for fehler in ergebnis['fehler']:
+        click.echo(f"   Zeile {fehler['zeile']}: {fehler['fehler']}")
+    click.echo(f"{ergebnis['importiert']} von {ergebnis['zeilen']} Rapporten importiert, "
+               f"{len(ergebnis['fehler'])} Fehler ({time.perf_counter() - start:.2f}s)")
+    if ergebnis['fehler'] and not ergebnis['importiert'] and not nur_pruefen:
+        click.echo("Nichts importiert, --teilweise übernimmt die gültigen Zeilen")
+    if ergebnis['fehler']:
+        raise SystemExit(1)
+
+@app.cli.command('migrationen')
+def migrationen_command():
+    """Stand der Schema-Migrationen anzeigen (ausstehende laufen beim Start automatisch)"""
+    for eintrag in migrations_status(get_db()):
+        if eintrag['angewendet_am'] is None:
+            click.echo(f"   {eintrag['version']:>3}  {eintrag['name']:<24} ausstehend")
+            continue
+        dauer = f"{eintrag['dauer_ms']} ms" if eintrag['dauer_ms'] is not None else 'übernommen'
+        click.echo(f"✓  {eintrag['version']:>3}  {eintrag['name']:<24} {eintrag['angewendet_am']}  ({dauer})")
+
+@app.cli.command('salden')
+@click.option('--neu-aufbauen', 'neu_aufbauen', is_flag=True, help='Salden aus allen Rapporten neu berechnen')
+def salden_command(neu_aufbauen):
+    """Kundensalden (kunden_saldo) gegen die Rapporte prüfen oder neu aufbauen"""
+    db = get_db()
+    if neu_aufbauen:
+        baue_salden_neu(db)
+        db.commit()
+        daten_geaendert()
+        click.echo("Salden neu aufgebaut")
+    abweichungen = pruefe_salden(db)
+    for a in abweichungen:
+        click.echo(f"   ⚠ Kunde {a['kunde_id']}: {a['spalte']} gespeichert {a['ist']}, berechnet {a['soll']}")
+    click.echo(f"{len(abweichungen)} Abweichungen")
+    if abweichungen:
+        raise SystemExit(1)
+
+@app.cli.command('snapshot')
+def snapshot_command():
+    """Lesekopie für Exporte und Auswertung jetzt erneuern (z.B. per cron, nur mit SNAPSHOT=1)"""
+    snapshot = app.extensions.get('snapshot')
+    if snapshot is None:
+        raise click.ClickException("Lesekopie ist nicht aktiviert (SNAPSHOT=1)")
+    dauer_ms = snapshot.erneuern()
+    groesse_mb = os.path.getsize(snapshot.datei) / 1024 / 1024
+    click.echo(f"Lesekopie {snapshot.datei} erneuert ({groesse_mb:.1f} MB, {dauer_ms} ms)")
+
+def _groesse_mb(bytes_):
+    return f"{bytes_ / 1024 / 1024:.1f} MB"
+
+@app.cli.command('backup')
+def backup_command():
+    """Online-Backup der Datenbank nach BACKUP_DIR (komprimiert, geprüft, mit Aufbewahrung)"""
+    try:
+        ergebnis = erstelle_backup(app.config['DATABASE'], app.config['BACKUP_DIR'],
+                                   anzahl=app.config['BACKUP_ANZAHL'], melde=click.echo)
+    except BackupFehler as e:
+        raise click.ClickException(str(e))
+    for datei in ergebnis['geloescht']:
+        click.echo(f"   gelöscht: {os.path.basename(datei)}")
+    anzahl = ', '.join(f"{n} {tabelle}" for tabelle, n in ergebnis['anzahl'].items())
+    click.echo(f"✓ {ergebnis['datei']} ({_groesse_mb(ergebnis['groesse'])}, {ergebnis['dauer_s']}s; {anzahl})")
+
+@app.cli.command('backups')
+def backups_command():
+    """Vorhandene Backups in BACKUP_DIR auflisten (neustes zuerst)"""
+    backups = liste_backups(app.config['BACKUP_DIR'])
+    for backup in backups:
+        click.echo(f"   {backup['zeit']:%d.%m.%Y %H:%M:%S}  {_groesse_mb(backup['groesse']):>10}  {backup['datei']}")
+    click.echo(f"{len(backups)} Backups in {app.config['BACKUP_DIR']}")
+
+@app.cli.command('backup-pruefen')
+@click.argument('datei', required=False, type=click.Path(exists=True, dir_okay=False))
+def backup_pruefen_command(datei):
+    """Backup mit PRAGMA integrity_check prüfen (ohne DATEI: das neuste)"""
+    if datei is None:
+        backups = liste_backups(app.config['BACKUP_DIR'])
+        if not backups:
+            raise click.ClickException(f"Keine Backups in {app.config['BACKUP_DIR']}")
+        datei = backups[0]['datei']
+    try:
+        pruefung = pruefe_backup(datei)
+    except BackupFehler as e:
+        raise click.ClickException(str(e))
+    for fehler in pruefung['fehler'][:20]:
+        click.echo(f"   ⚠ {fehler}")
+    if pruefung['fehler']:
+        click.echo(f"{datei}: {len(pruefung['fehler'])} Fehler")
+        raise SystemExit(1)
+    anzahl = ', '.join(f"{n} {tabelle}" for tabelle, n in pruefung['anzahl'].items())
+    click.echo(f"✓ {datei}: ok ({anzahl})")
+
+@app.cli.command('backup-zurueckspielen')
+@click.argument('datei', type=click.Path(exists=True, dir_okay=False))
+@click.confirmation_option(prompt='Aktuelle Daten durch das Backup ersetzen?')
+def backup_zurueckspielen_command(datei):
+    """Backup in die laufende Datenbank zurückspielen (vorher wird der aktuelle Stand gesichert)"""
+    try:
+        vorher = erstelle_backup(app.config['DATABASE'], app.config['BACKUP_DIR'], anzahl=0, melde=click.echo)
+        if os.path.samefile(vorher['datei'], datei):
+            raise BackupFehler(f"Sicherung des aktuellen Stands überschreibt {datei}")
+        click.echo(f"Aktueller Stand gesichert: {vorher['datei']}")
+        pruefung = spiele_backup_zurueck(datei, app.config['DATABASE'], melde=click.echo)
+    except BackupFehler as e:
+        raise click.ClickException(str(e))
+    # Älteres Backup: fehlende Migrationen nachholen; Caches und Lesekopie aller Prozesse verwerfen
+    migriere(get_db(), melde=click.echo)
+    daten_geaendert()
+    snapshot = app.extensions.get('snapshot')
+    if snapshot is not None:
+        snapshot.erneuern()
+    anzahl = ', '.join(f"{n} {tabelle}" for tabelle, n in pruefung['anzahl'].items())
+    click.echo(f"✓ {datei} zurückgespielt ({anzahl})")
+
+@app.cli.command('abfrageplaene')
+def abfrageplaene_command():
+    """EXPLAIN QUERY PLAN der Abfragen aller Routen ausgeben"""
+    db = get_db()
+    von, bis = '2000-01-01', '2999-12-31'
+    abfragen = [
+        ('index (ohne Filter)', UEBERSICHT_SQL, ('', '', '', '')),
+        ('index (Kunde)', UEBERSICHT_SQL, ('1', '', '', '')),
+        ('index (Kunde + Zeitraum)', UEBERSICHT_SQL, ('1', von, bis, '')),
+        ('index (offen)', UEBERSICHT_SQL, ('', '', '', '0')),
+        ('index (bezahlt + Zeitraum)', UEBERSICHT_SQL, ('', von, bis, '1')),
+        ('index (Zeitraum)', UEBERSICHT_SQL, ('', von, bis, '')),
+        ('index (nicht verrechnet)', UEBERSICHT_SQL, ('', '', '', '', '0')),
+        ('export_csv/export_pdf (Kunde + offen)', EXPORT_SQL, ('1', '', '', '0')),
+        ('export_csv/export_pdf (Zeitraum)', EXPORT_SQL, ('', von, bis, '')),
+    ]
+    plaene = []
+    for name, basis, filter_args in abfragen:
+        bedingung, params = rapporte_filter(*filter_args)
+        if basis == UEBERSICHT_SQL:
+            # Erste Seite der Übersicht (Keyset-Pagination)
+            plaene.append((name, basis + bedingung + ' ORDER BY r.datum DESC, r.id DESC LIMIT ?',
+                           params + [app.config['SEITENGROESSE'] + 1]))
+        else:
+            plaene.append((name, basis + bedingung + ' ORDER BY r.datum DESC', params))
+    plaene += [
+        ('kunde_detail (Rapporte)', KUNDE_RAPPORTE_SQL, [1]),
+        ('kunde_detail (Login-Daten)', 'SELECT * FROM login_daten WHERE kunde_id = ?', [1]),
+        ('rechnung_konsolidiert',
+         'SELECT * FROM rapporte WHERE kunde_id = ? AND datum >= ? AND datum <= ? ORDER BY datum ASC', [1, von, bis]),
+        ('rechnungslauf',
+         'SELECT DISTINCT kunde_id FROM rapporte WHERE bezahlt = 0 AND datum >= ? AND datum <= ? ORDER BY kunde_id',
+         [von, bis]),
+        ('kunden_liste', KUNDEN_LISTE_SQL, []),
+        ('kunde_detail (Saldo)', 'SELECT * FROM kunden_saldo WHERE kunde_id = ?', [1]),
+    ]
+
+    # Bekannte Sortierungen im Speicher: DISTINCT kunde_id sortiert nur die Kunden-IDs
+    # der offenen Rapporte im Zeitraum (kein Index liefert sie nach bezahlt/datum gefiltert sortiert)
+    erwartet = {'rechnungslauf': 'USE TEMP B-TREE FOR DISTINCT'}
+
+    warnungen = 0
+    for name, query, params in plaene:
+        click.echo(f"== {name}")
+        for zeile in abfrageplan(db, query, params):
+            # Tabellen-Scan ohne Index oder Sortierung im Speicher
+            verdaechtig = ((zeile.startswith('SCAN') and 'INDEX' not in zeile)
+                           or ('TEMP B-TREE' in zeile and zeile != erwartet.get(name)))
+            warnungen += verdaechtig
+            click.echo(f"   {'⚠ ' if verdaechtig else ''}{zeile}")
+    click.echo(f"{warnungen} Warnungen")
+    if warnungen:
+        raise SystemExit(1)
+
+@app.route('/status')
+@auth.login_required
+def status():
+    """Status von Verbindungs-Pool, Seiten-Cache und Lesekopie als JSON"""
+    snapshot = app.extensions.get('snapshot')
+    return jsonify({'db_pool': get_pool().status(), 'seiten_cache': seiten_cache.status(),
+                    'snapshot': snapshot.status() if snapshot else None})
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+@auth.login_required
+def profile_liste():
+    """Profiler für die nächsten N PDF-Erstellungen schalten und gespeicherte Profile auflisten"""
+    if request.method == 'POST':
+        anzahl = request.form.get('anzahl', '0')
+        pdf_profiler.aktiviere(min(int(anzahl), 100) if anzahl.isdigit() else 0)
+        return redirect(url_for('profile_liste'))
+
+    return render_template('profile.html', verbleibend=pdf_profiler.verbleibend(),
+                           profile=pdf_profiler.profile())
+
+@app.route('/admin/profile/<name>')
+@auth.login_required
+def profil_anzeigen(name):
+    """Textauswertung eines Profils oder Download der pstats-Datei (?download=1)"""
+    if os.path.basename(name) != name or not name.endswith('.prof'):
+        abort(404)
+    if not os.path.isfile(os.path.join(app.config['PROFILE_DIR'], name)):
+        abort(404)
+    if request.args.get('download'):
+        return send_from_directory(app.config['PROFILE_DIR'], name, as_attachment=True)
+    return render_template('profil_auswertung.html', name=name, auswertung=pdf_profiler.auswertung(name))
+
+@app.route('/metrics')
+@auth.login_required
+def metrics():
+    """Histogramme der Request-Messung im Prometheus-Textformat (nur mit METRIKEN=1)"""
+    metriken = app.extensions.get('metriken')
+    if metriken is None:
+        abort(404)
+    return Response(metriken.als_text(), mimetype='text/plain; version=0.0.4')
 
 @app.teardown_appcontext
 def close_connection(exception):
-    """Schließe Datenbankverbindung"""
-    db = getattr(Flask, '_database', None)
-    if db is not None:
-        db.close()
+    """Gib Datenbankverbindung an den Pool zurück"""
+    close_db(exception)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8085, debug=True)
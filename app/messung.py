@@ -0,0 +1,247 @@
+"""Messung von Requests (opt-in über METRIKEN=1)
+
+Pro Request werden SQL-Statements (Anzahl, Zeit, langsamste), Template-Rendering
+und PDF-/QR-Erstellung erfasst. Die Werte gehen als Server-Timing-Header an den
+Browser und werden als Histogramme unter /metrics (Prometheus-Textformat) summiert.
+"""
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+
+# Bucket-Grenzen für Dauern (Sekunden) und Statement-Anzahlen
+DAUER_GRENZEN = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ANZAHL_GRENZEN = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Anzahl langsamster Statements im Header (pro Request) bzw. unter /metrics (gesamt)
+LANGSAMSTE_REQUEST = 3
+LANGSAMSTE_GESAMT = 10
+
+BESCHREIBUNGEN = {
+    'rapporte_request_dauer_sekunden': ('histogram', 'Dauer pro Request bis zur Antwort'),
+    'rapporte_sql_dauer_sekunden': ('histogram', 'SQL-Zeit pro Request'),
+    'rapporte_sql_statements': ('histogram', 'SQL-Statements pro Request'),
+    'rapporte_abschnitt_dauer_sekunden': ('histogram', 'Dauer von Abschnitten (render, pdf, qr, auth) pro Request'),
+    'rapporte_sql_langsamste_sekunden': ('gauge', 'Langsamste einzelne SQL-Statements seit dem Start'),
+}
+
+class RequestMessung:
+    """Messwerte eines einzelnen Requests"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = []  # [sql, dauer] pro ausgeführtem Statement
+        self.abschnitte = {}
+
+    def statement(self, sql):
+        """Neues Statement erfassen; Dauer wird laufend am Eintrag aufsummiert"""
+        eintrag = [sql, 0.0]
+        self.statements.append(eintrag)
+        return eintrag
+
+    def addiere(self, name, dauer):
+        self.abschnitte[name] = self.abschnitte.get(name, 0.0) + dauer
+
+    @property
+    def sql_zeit(self):
+        return sum(dauer for _, dauer in self.statements)
+
+    def langsamste(self, anzahl):
+        return sorted(self.statements, key=lambda e: e[1], reverse=True)[:anzahl]
+
+class MessCursor(sqlite3.Cursor):
+    """Cursor, der Ausführung und Abholen der Zeilen dem jeweiligen Statement zurechnet"""
+    _eintrag = None
+
+    def _gemessen(self, funktion, *args):
+        start = time.perf_counter()
+        try:
+            return funktion(*args)
+        finally:
+            if self._eintrag is not None:
+                self._eintrag[1] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        messung = self.connection.messung
+        self._eintrag = messung.statement(sql) if messung else None
+        return self._gemessen(super().execute, sql, parameters)
+
+    def executemany(self, sql, parameters):
+        messung = self.connection.messung
+        self._eintrag = messung.statement(sql) if messung else None
+        return self._gemessen(super().executemany, sql, parameters)
+
+    def fetchone(self):
+        return self._gemessen(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._gemessen(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._gemessen(super().fetchall)
+
+    def __next__(self):
+        return self._gemessen(super().__next__)
+
+class MessVerbindung(sqlite3.Connection):
+    """SQLite-Verbindung mit MessCursor; messung wird von get_db() pro Request gesetzt"""
+    messung = None
+
+    def cursor(self, factory=MessCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+def aktuelle_messung():
+    """Messung des laufenden Requests oder None (Messung aus, CLI, Worker-Prozess)"""
+    return g.get('messung') if has_request_context() else None
+
+@contextmanager
+def messe_abschnitt(name):
+    """Misst einen Abschnitt des laufenden Requests (auch als Dekorator verwendbar)"""
+    messung = aktuelle_messung()
+    if messung is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        messung.addiere(name, time.perf_counter() - start)
+
+class Histogramm:
+    """Histogramm mit festen Bucket-Grenzen"""
+
+    def __init__(self, grenzen):
+        self.grenzen = grenzen
+        self.buckets = [0] * (len(grenzen) + 1)  # letzter Bucket: +Inf
+        self.summe = 0.0
+        self.anzahl = 0
+
+    def beobachte(self, wert):
+        self.buckets[bisect_left(self.grenzen, wert)] += 1
+        self.summe += wert
+        self.anzahl += 1
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    teile = []
+    for name, wert in labels:
+        wert = str(wert).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+        teile.append(f'{name}="{wert}"')
+    return '{' + ','.join(teile) + '}'
+
+class Metriken:
+    """Summierte Messwerte aller Requests dieses Prozesses (threadsicher)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramme = {}
+        self._langsamste = []  # (dauer, sql, route)
+
+    def _histogramm(self, name, labels, grenzen=DAUER_GRENZEN):
+        schluessel = (name, labels)
+        histogramm = self._histogramme.get(schluessel)
+        if histogramm is None:
+            histogramm = self._histogramme[schluessel] = Histogramm(grenzen)
+        return histogramm
+
+    def erfasse(self, route, messung, dauer):
+        """Werte eines abgeschlossenen Requests übernehmen"""
+        labels = (('route', route),)
+        with self._lock:
+            self._histogramm('rapporte_request_dauer_sekunden', labels).beobachte(dauer)
+            self._histogramm('rapporte_sql_dauer_sekunden', labels).beobachte(messung.sql_zeit)
+            self._histogramm('rapporte_sql_statements', labels, ANZAHL_GRENZEN).beobachte(len(messung.statements))
+            for name, abschnitt_dauer in messung.abschnitte.items():
+                self._histogramm('rapporte_abschnitt_dauer_sekunden',
+                                 labels + (('abschnitt', name),)).beobachte(abschnitt_dauer)
+
+            kandidaten = self._langsamste + [(d, ' '.join(sql.split()), route)
+                                             for sql, d in messung.langsamste(LANGSAMSTE_GESAMT)]
+            self._langsamste = sorted(kandidaten, reverse=True)[:LANGSAMSTE_GESAMT]
+
+    def als_text(self):
+        """Alle Werte im Prometheus-Textformat"""
+        with self._lock:
+            histogramme = sorted(self._histogramme.items())
+            langsamste = list(self._langsamste)
+
+        zeilen = []
+        bisheriger_name = None
+        for (name, labels), h in histogramme:
+            if name != bisheriger_name:
+                typ, hilfe = BESCHREIBUNGEN[name]
+                zeilen += [f'# HELP {name} {hilfe}', f'# TYPE {name} {typ}']
+                bisheriger_name = name
+            kumuliert = 0
+            for grenze, anzahl in zip(list(h.grenzen) + ['+Inf'], h.buckets):
+                kumuliert += anzahl
+                zeilen.append(f'{name}_bucket{_label_text(labels + (("le", grenze),))} {kumuliert}')
+            zeilen.append(f'{name}_sum{_label_text(labels)} {h.summe:.6f}')
+            zeilen.append(f'{name}_count{_label_text(labels)} {h.anzahl}')
+
+        if langsamste:
+            name = 'rapporte_sql_langsamste_sekunden'
+            typ, hilfe = BESCHREIBUNGEN[name]
+            zeilen += [f'# HELP {name} {hilfe}', f'# TYPE {name} {typ}']
+            for rang, (dauer, sql, route) in enumerate(langsamste, start=1):
+                labels = (('rang', rang), ('route', route), ('sql', sql[:200]))
+                zeilen.append(f'{name}{_label_text(labels)} {dauer:.6f}')
+        return '\n'.join(zeilen) + '\n'
+
+def _header_text(text, laenge=80):
+    """Kurzer, ASCII-sicherer Text für den desc-Teil des Server-Timing-Headers"""
+    text = ' '.join(text.split())[:laenge]
+    return text.encode('ascii', 'replace').decode('ascii').replace('\\', '').replace('"', "'")
+
+def server_timing(messung, dauer):
+    """Server-Timing-Header (Werte in ms) für einen Request"""
+    eintraege = [f'sql;dur={messung.sql_zeit * 1000:.1f};desc="{len(messung.statements)} Statements"']
+    for rang, (sql, sql_dauer) in enumerate(messung.langsamste(LANGSAMSTE_REQUEST), start=1):
+        eintraege.append(f'sql-{rang};dur={sql_dauer * 1000:.1f};desc="{_header_text(sql)}"')
+    for name, abschnitt_dauer in sorted(messung.abschnitte.items()):
+        eintraege.append(f'{name};dur={abschnitt_dauer * 1000:.1f}')
+    eintraege.append(f'total;dur={dauer * 1000:.1f}')
+    return ', '.join(eintraege)
+
+def _render_start(sender, template, context, **extra):
+    if aktuelle_messung() is not None:
+        g.messung_render_start = time.perf_counter()
+
+def _render_ende(sender, template, context, **extra):
+    messung = aktuelle_messung()
+    start = g.pop('messung_render_start', None)
+    if messung is not None and start is not None:
+        messung.addiere('render', time.perf_counter() - start)
+
+def aktiviere_messung(app):
+    """Registriert Request-Hooks und Template-Signale; Metriken unter app.extensions['metriken']"""
+    metriken = app.extensions['metriken'] = Metriken()
+
+    @app.before_request
+    def _messung_starten():
+        g.messung = RequestMessung()
+
+    @app.after_request
+    def _messung_beenden(response):
+        # Bei Streaming-Antworten (CSV-Export) fehlt die Zeit für den noch nicht gesendeten Rest
+        messung = g.get('messung')
+        if messung is None:
+            return response
+        dauer = time.perf_counter() - messung.start
+        response.headers['Server-Timing'] = server_timing(messung, dauer)
+        metriken.erfasse(request.endpoint or 'unbekannt', messung, dauer)
+        return response
+
+    before_render_template.connect(_render_start, app)
+    template_rendered.connect(_render_ende, app)
+    return metriken
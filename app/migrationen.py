@@ -0,0 +1,404 @@
+"""Nummerierte Schema-Migrationen mit Versionstabelle schema_version
+
+Jede Migration läuft in einer eigenen Transaktion (BEGIN IMMEDIATE) und wird
+mit Zeitpunkt und Dauer in schema_version eingetragen. Ist das Schema aktuell,
+kostet der Start nur eine Abfrage. Daten-Backfills laufen blockweise mit
+executemany und melden den Fortschritt.
+"""
+import re
+import sqlite3
+import sys
+import time
+
+from app.saldo import SALDO_TABELLE, SALDO_TRIGGER, baue_salden_neu
+
+# Zeilen pro Block bei Daten-Backfills
+MIGRATION_BLOCKGROESSE = 1000
+
+def _melde(text):
+    print(text, file=sys.stderr, flush=True)
+
+def ensure_column(db, table, column, decl):
+    """Fügt Spalte hinzu, falls sie in der Tabelle noch fehlt"""
+    columns = [col[1] for col in db.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def fuelle_blockweise(db, melde, tabelle, spalten, bedingung, update_sql, umwandeln):
+    """Backfill: Zeilen mit bedingung blockweise (nach id) lesen, umwandeln(row) per executemany schreiben"""
+    gesamt = db.execute(f'SELECT COUNT(*) FROM {tabelle} WHERE {bedingung}').fetchone()[0]
+    letzte_id, erledigt = 0, 0
+    while True:
+        rows = db.execute(
+            f'SELECT id, {spalten} FROM {tabelle} WHERE ({bedingung}) AND id > ? ORDER BY id LIMIT ?',
+            (letzte_id, MIGRATION_BLOCKGROESSE)
+        ).fetchall()
+        if not rows:
+            break
+        db.executemany(update_sql, [umwandeln(row) for row in rows])
+        letzte_id = rows[-1]['id']
+        erledigt += len(rows)
+        melde(f"   {tabelle}: {erledigt}/{gesamt}")
+    return erledigt
+
+def parse_adresse(adresse_text):
+    """Versucht Adresse in Komponenten zu zerlegen"""
+    if not adresse_text:
+        return None, None, None, None
+
+    lines = [l.strip() for l in adresse_text.strip().split('\n') if l.strip()]
+
+    strasse = None
+    hausnummer = None
+    plz = None
+    stadt = None
+
+    # Erste Zeile: Strasse + Hausnummer
+    if len(lines) >= 1:
+        # Trenne Hausnummer am Ende ab (Zahlen oder Zahlen+Buchstabe)
+        match = re.match(r'^(.+?)\s+(\d+[a-zA-Z]?)$', lines[0])
+        if match:
+            strasse = match.group(1).strip()
+            hausnummer = match.group(2).strip()
+        else:
+            strasse = lines[0]
+
+    # Letzte Zeile: PLZ + Stadt
+    if len(lines) >= 2:
+        last_line = lines[-1]
+        match = re.match(r'^(\d{4})\s+(.+)$', last_line)
+        if match:
+            plz = match.group(1)
+            stadt = match.group(2).strip()
+
+    return strasse, hausnummer, plz, stadt
+
+def _schema_basis(db, melde):
+    """Grundtabellen; ergänzt Spalten, die in alten Datenbanken fehlen"""
+    # Kunden Tabelle
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS kunden (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT,
+            telefon TEXT,
+            adresse TEXT,
+            strasse TEXT,
+            hausnummer TEXT,
+            plz TEXT,
+            stadt TEXT,
+            it_infrastruktur TEXT,
+            stundensatz REAL DEFAULT 120.0,
+            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Login-Daten Tabelle
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS login_daten (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kunde_id INTEGER NOT NULL,
+            geraet_typ TEXT NOT NULL,
+            beschreibung TEXT,
+            username TEXT,
+            passwort TEXT,
+            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (kunde_id) REFERENCES kunden (id)
+        )
+    ''')
+
+    # Rapporte Tabelle
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS rapporte (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kunde_id INTEGER NOT NULL,
+            datum DATE NOT NULL,
+            dauer_minuten INTEGER NOT NULL,
+            thema TEXT NOT NULL,
+            kosten REAL,
+            bezahlt BOOLEAN DEFAULT 0,
+            zahlungsart TEXT,
+            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (kunde_id) REFERENCES kunden (id)
+        )
+    ''')
+
+    # Rechnungen Tabelle
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS rechnungen (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rechnungs_nummer TEXT UNIQUE NOT NULL,
+            kunde_id INTEGER NOT NULL,
+            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            betrag REAL NOT NULL,
+            rapport_ids TEXT NOT NULL,
+            pdf_hash TEXT,
+            eingabe_hash TEXT,
+            FOREIGN KEY (kunde_id) REFERENCES kunden (id)
+        )
+    ''')
+
+    # Spalten aus späteren Schema-Änderungen (früher migrate_adressen.py / add_stundensatz.py)
+    for spalte in ('strasse', 'hausnummer', 'plz', 'stadt'):
+        ensure_column(db, 'kunden', spalte, 'TEXT')
+    ensure_column(db, 'kunden', 'stundensatz', 'REAL DEFAULT 120.0')
+    # Spalten für gespeicherte Rechnungs-PDFs
+    ensure_column(db, 'rechnungen', 'pdf_hash', 'TEXT')
+    ensure_column(db, 'rechnungen', 'eingabe_hash', 'TEXT')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_rechnungen_eingabe_hash ON rechnungen (eingabe_hash)')
+
+def _schema_indizes(db, melde):
+    """Indizes passend zu den Filter- und Sortierpfaden der Routen"""
+    # Übersicht/Exporte/Kundendetail/Rechnungen: kunde_id (+ datum-Bereich, Sortierung nach datum)
+    db.execute('CREATE INDEX IF NOT EXISTS idx_rapporte_kunde_datum ON rapporte (kunde_id, datum)')
+    # Status-Filter (bezahlt/offen) und Rechnungslauf (offene Rapporte im Zeitraum)
+    db.execute('CREATE INDEX IF NOT EXISTS idx_rapporte_bezahlt_datum ON rapporte (bezahlt, datum, kunde_id)')
+    # Ungefilterte Übersicht und reine Datumsfilter, sortiert nach datum
+    db.execute('CREATE INDEX IF NOT EXISTS idx_rapporte_datum ON rapporte (datum)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_login_daten_kunde ON login_daten (kunde_id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_rechnungen_kunde ON rechnungen (kunde_id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_kunden_name ON kunden (name)')
+    # Statistiken für den Query Planner (Wahl zwischen den Rapporte-Indizes)
+    db.execute('ANALYZE')
+
+def _schema_rechnungs_zaehler(db, melde):
+    """Tageszähler für Rechnungsnummern, initialisiert aus bestehenden Rechnungen"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS rechnungs_zaehler (
+            tag TEXT PRIMARY KEY,
+            letzte_nummer INTEGER NOT NULL
+        )
+    ''')
+    # RE-YYYYMMDD-XXXXX: Tag ab Zeichen 4, laufende Nummer ab Zeichen 13
+    db.execute('''
+        INSERT OR IGNORE INTO rechnungs_zaehler (tag, letzte_nummer)
+        SELECT substr(rechnungs_nummer, 4, 8), MAX(CAST(substr(rechnungs_nummer, 13) AS INTEGER))
+        FROM rechnungen
+        WHERE rechnungs_nummer LIKE 'RE-%'
+        GROUP BY substr(rechnungs_nummer, 4, 8)
+    ''')
+
+def _schema_rechnung_positionen(db, melde):
+    """Zuordnung Rechnung <-> Rapport als Tabelle statt kommagetrennter rapport_ids"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS rechnung_positionen (
+            rechnung_id INTEGER NOT NULL,
+            rapport_id INTEGER NOT NULL,
+            PRIMARY KEY (rechnung_id, rapport_id),
+            FOREIGN KEY (rechnung_id) REFERENCES rechnungen (id) ON DELETE CASCADE,
+            FOREIGN KEY (rapport_id) REFERENCES rapporte (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    # Rückwärtssuche: welche Rechnung deckt einen Rapport ab / noch nicht verrechnet
+    db.execute('CREATE INDEX IF NOT EXISTS idx_rechnung_positionen_rapport ON rechnung_positionen (rapport_id, rechnung_id)')
+
+    # Bestehende Rechnungen übernehmen (nur noch existierende Rapporte)
+    positionen = []
+    for row in db.execute('SELECT id, rapport_ids FROM rechnungen').fetchall():
+        for rapport_id in (row['rapport_ids'] or '').split(','):
+            if rapport_id.strip().isdigit():
+                positionen.append((row['id'], int(rapport_id)))
+    db.executemany(
+        'INSERT OR IGNORE INTO rechnung_positionen (rechnung_id, rapport_id) '
+        'SELECT ?, id FROM rapporte WHERE id = ?',
+        positionen
+    )
+
+# Trigger für External-Content-Tabellen (Löschen erfordert die alten Werte).
+# Einzelne Statements statt executescript, das die Transaktion vorzeitig committen würde.
+FTS_TRIGGER = [
+    '''CREATE TRIGGER IF NOT EXISTS rapporte_fts_insert AFTER INSERT ON rapporte BEGIN
+        INSERT INTO rapporte_fts (rowid, thema) VALUES (new.id, new.thema);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS rapporte_fts_delete AFTER DELETE ON rapporte BEGIN
+        INSERT INTO rapporte_fts (rapporte_fts, rowid, thema) VALUES ('delete', old.id, old.thema);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS rapporte_fts_update AFTER UPDATE OF thema ON rapporte BEGIN
+        INSERT INTO rapporte_fts (rapporte_fts, rowid, thema) VALUES ('delete', old.id, old.thema);
+        INSERT INTO rapporte_fts (rowid, thema) VALUES (new.id, new.thema);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS kunden_fts_insert AFTER INSERT ON kunden BEGIN
+        INSERT INTO kunden_fts (rowid, name, it_infrastruktur) VALUES (new.id, new.name, new.it_infrastruktur);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS kunden_fts_delete AFTER DELETE ON kunden BEGIN
+        INSERT INTO kunden_fts (kunden_fts, rowid, name, it_infrastruktur)
+        VALUES ('delete', old.id, old.name, old.it_infrastruktur);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS kunden_fts_update AFTER UPDATE OF name, it_infrastruktur ON kunden BEGIN
+        INSERT INTO kunden_fts (kunden_fts, rowid, name, it_infrastruktur)
+        VALUES ('delete', old.id, old.name, old.it_infrastruktur);
+        INSERT INTO kunden_fts (rowid, name, it_infrastruktur) VALUES (new.id, new.name, new.it_infrastruktur);
+    END''',
+]
+
+def _schema_volltextsuche(db, melde):
+    """FTS5-Index über Rapport-Themen und Kunden-Infrastruktur, per Trigger synchron"""
+    db.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS rapporte_fts USING fts5(
+            thema, content='rapporte', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    db.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS kunden_fts USING fts5(
+            name, it_infrastruktur, content='kunden', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    for trigger in FTS_TRIGGER:
+        db.execute(trigger)
+
+    # Bestehende Daten indizieren
+    db.execute("INSERT INTO rapporte_fts (rapporte_fts) VALUES ('rebuild')")
+    db.execute("INSERT INTO kunden_fts (kunden_fts) VALUES ('rebuild')")
+
+def _schema_jobs(db, melde):
+    """Warteschlange für Hintergrund-Jobs (Exporte, Rechnungen)"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            art TEXT NOT NULL,
+            parameter TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'wartend',
+            erstellt_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            gestartet_am TIMESTAMP,
+            beendet_am TIMESTAMP,
+            worker_pid INTEGER,
+            datei TEXT,
+            dateiname TEXT,
+            mimetype TEXT,
+            fehler TEXT
+        )
+    ''')
+    # Nächsten wartenden Job holen, laufende Jobs prüfen
+    db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+
+def _schema_adressen(db, melde):
+    """Freitext-Adressen in Strasse, Hausnummer, PLZ und Ort aufteilen (nur Kunden ohne diese Felder)"""
+    fuelle_blockweise(
+        db, melde, 'kunden', 'adresse',
+        "TRIM(COALESCE(adresse, '')) != '' AND strasse IS NULL AND hausnummer IS NULL "
+        "AND plz IS NULL AND stadt IS NULL",
+        'UPDATE kunden SET strasse = ?, hausnummer = ?, plz = ?, stadt = ? WHERE id = ?',
+        lambda row: (*parse_adresse(row['adresse']), row['id'])
+    )
+
+def _schema_kunden_saldo(db, melde):
+    """Laufende Salden pro Kunde, per Trigger auf rapporte aktuell gehalten"""
+    db.execute(SALDO_TABELLE)
+    for trigger in SALDO_TRIGGER:
+        db.execute(trigger)
+    baue_salden_neu(db)
+
+def _schema_index_bezahlt_datum(db, melde):
+    """Status-Index ohne kunde_id: datum-Gleichstand per rowid, wie in ORDER BY datum, id"""
+    # (bezahlt, datum, kunde_id) sortierte bei gleichem Datum nach kunde_id statt id,
+    # die Übersicht brauchte dafür eine zusätzliche Sortierung im Speicher
+    db.execute('DROP INDEX IF EXISTS idx_rapporte_bezahlt_datum')
+    db.execute('CREATE INDEX idx_rapporte_bezahlt_datum ON rapporte (bezahlt, datum)')
+    db.execute('ANALYZE rapporte')
+
+def _schema_reservierung(db, melde):
+    """Ablauf der Reservierung einer Rechnungsnummer (Wiederverwendung nach Abbruch)"""
+    # NULL: Reservierung freigegeben oder aus der Zeit vor dieser Migration
+    ensure_column(db, 'rechnungen', 'reserviert_bis', 'TIMESTAMP')
+
+def _schema_rechnungs_art(db, melde):
+    """Art der Rechnung (einzeln/konsolidiert) für den Dateinamen beim erneuten Download"""
+    ensure_column(db, 'rechnungen', 'art', 'TEXT')
+    # Bestehende Rechnungen: mehrere Rapporte nur bei konsolidierten (eine mit nur einem
+    # Rapport ist nicht unterscheidbar und heisst danach wie eine Einzelrechnung)
+    db.execute("UPDATE rechnungen SET art = CASE WHEN instr(rapport_ids, ',') THEN 'konsolidiert' "
+               "ELSE 'einzeln' END WHERE art IS NULL")
+
+# Migrationen: (Version, Name, Funktion). Neue Migrationen nur hinten anhängen!
+MIGRATIONEN = [
+    (1, 'basis', _schema_basis),
+    (2, 'indizes', _schema_indizes),
+    (3, 'rechnungs_zaehler', _schema_rechnungs_zaehler),
+    (4, 'rechnung_positionen', _schema_rechnung_positionen),
+    (5, 'volltextsuche', _schema_volltextsuche),
+    (6, 'jobs', _schema_jobs),
+    (7, 'adressen_aufteilen', _schema_adressen),
+    (8, 'kunden_saldo', _schema_kunden_saldo),
+    (9, 'index_bezahlt_datum', _schema_index_bezahlt_datum),
+    (10, 'rechnungen_reservierung', _schema_reservierung),
+    (11, 'rechnungs_art', _schema_rechnungs_art),
+]
+
+def _angewendete_anzahl(db):
+    """Anzahl eingetragener Migrationen (None: schema_version fehlt noch)"""
+    try:
+        return db.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def _lege_versionstabelle_an(db):
+    """Legt schema_version an; bestehende Datenbanken übernehmen den Stand aus PRAGMA user_version"""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                angewendet_am TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                dauer_ms INTEGER
+            )
+        ''')
+        leer = db.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == 0
+        alte_version = db.execute('PRAGMA user_version').fetchone()[0]
+        if leer and alte_version:
+            # user_version 1-5 entsprach den Migrationen 2-6; basis und adressen_aufteilen
+            # laufen trotzdem, da alte Datenbanken Spalten oder Adressfelder fehlen können
+            db.executemany('INSERT INTO schema_version (version, name) VALUES (?, ?)',
+                           [(version, name) for version, name, _ in MIGRATIONEN
+                            if 2 <= version <= alte_version + 1])
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+def migriere(db, melde=_melde):
+    """Wendet ausstehende Migrationen an, gibt die Anzahl angewendeter Migrationen zurück"""
+    anzahl = _angewendete_anzahl(db)
+    if anzahl == len(MIGRATIONEN):
+        return 0  # Normalfall beim Start: Schema ist aktuell
+
+    if db.in_transaction:
+        db.commit()
+    if anzahl is None:
+        _lege_versionstabelle_an(db)
+
+    angewendet = 0
+    for version, name, migration in MIGRATIONEN:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # Unter der Schreibsperre prüfen: ein anderer Prozess kann schneller gewesen sein
+            if db.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                db.rollback()
+                continue
+            melde(f"Migration {version} ({name}) ...")
+            start = time.perf_counter()
+            migration(db, melde)
+            dauer_ms = round((time.perf_counter() - start) * 1000)
+            db.execute('INSERT INTO schema_version (version, name, dauer_ms) VALUES (?, ?, ?)',
+                       (version, name, dauer_ms))
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        melde(f"Migration {version} ({name}) fertig ({dauer_ms} ms)")
+        angewendet += 1
+    return angewendet
+
+def migrations_status(db):
+    """Alle Migrationen mit Zeitpunkt und Dauer (None, falls noch nicht angewendet)"""
+    eingetragen = {}
+    if _angewendete_anzahl(db) is not None:
+        eingetragen = {row['version']: row for row in db.execute('SELECT * FROM schema_version').fetchall()}
+    return [{
+        'version': version,
+        'name': name,
+        'angewendet_am': eingetragen[version]['angewendet_am'] if version in eingetragen else None,
+        'dauer_ms': eingetragen[version]['dauer_ms'] if version in eingetragen else None,
+    } for version, name, _ in MIGRATIONEN]
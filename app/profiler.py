@@ -0,0 +1,108 @@
+"""cProfile für die nächsten N PDF-Erstellungen (Rechnungen, QR-Rechnung)
+
+Der Zähler liegt als Datei im Profil-Verzeichnis, damit der Schalter für alle
+gunicorn-Worker und die Prozesse des Rechnungslaufs gleichzeitig gilt.
+"""
+import cProfile
+import fcntl
+import functools
+import io
+import os
+import pstats
+import threading
+from datetime import datetime
+
+# Sortierung und Zeilenzahl der Textauswertung
+AUSWERTUNG_SORTIERUNG = 'cumulative'
+AUSWERTUNG_ZEILEN = 60
+
+class PdfProfiler:
+    """Profiliert ausgewählte Funktionen, solange der Zähler im Profil-Verzeichnis > 0 ist"""
+
+    def __init__(self, verzeichnis):
+        self.verzeichnis = verzeichnis
+        self.schalter = os.path.join(verzeichnis, 'verbleibend')
+        self._lokal = threading.local()
+
+    def _zaehler(self, aenderung=None):
+        """Liest den Zähler unter Dateisperre; mit aenderung(wert) wird er neu gesetzt"""
+        os.makedirs(self.verzeichnis, exist_ok=True)
+        with open(self.schalter, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            inhalt = f.read().strip()
+            wert = int(inhalt) if inhalt.isdigit() else 0
+            if aenderung is not None:
+                wert = max(0, aenderung(wert))
+                f.seek(0)
+                f.truncate()
+                f.write(str(wert))
+                if wert == 0:
+                    os.remove(self.schalter)  # Profiler aus: _reserviere prüft nur noch os.path.exists
+            return wert
+
+    def aktiviere(self, anzahl):
+        """Die nächsten anzahl PDF-Erstellungen profilieren"""
+        self._zaehler(lambda _: anzahl)
+
+    def verbleibend(self):
+        if not os.path.exists(self.schalter):
+            return 0
+        return self._zaehler()
+
+    def _reserviere(self):
+        """Nimmt einen Durchlauf vom Zähler, falls noch welche offen sind"""
+        if not os.path.exists(self.schalter):
+            return False  # schneller Pfad: Profiler aus
+        vorher = []
+        self._zaehler(lambda wert: vorher.append(wert) or wert - 1)
+        return vorher[0] > 0
+
+    def profiliere(self, funktion):
+        """Dekorator: Aufruf profilieren, wenn der Schalter aktiv ist (verschachtelte Aufrufe nur einmal)"""
+        @functools.wraps(funktion)
+        def wrapper(*args, **kwargs):
+            if getattr(self._lokal, 'aktiv', False) or not self._reserviere():
+                return funktion(*args, **kwargs)
+
+            profil = cProfile.Profile()
+            self._lokal.aktiv = True
+            try:
+                return profil.runcall(funktion, *args, **kwargs)
+            finally:
+                self._lokal.aktiv = False
+                zeitpunkt = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+                profil.dump_stats(os.path.join(
+                    self.verzeichnis, f"{zeitpunkt}_{funktion.__name__}_{os.getpid()}.prof"))
+        return wrapper
+
+    def profile(self):
+        """Gespeicherte Profile, neueste zuerst"""
+        if not os.path.isdir(self.verzeichnis):
+            return []
+        eintraege = []
+        for name in os.listdir(self.verzeichnis):
+            if not name.endswith('.prof'):
+                continue
+            pfad = os.path.join(self.verzeichnis, name)
+            teile = name[:-len('.prof')].split('_')
+            try:
+                erstellt = datetime.strptime(teile[0], '%Y%m%d-%H%M%S-%f')
+                dauer = pstats.Stats(pfad).total_tt
+            except (ValueError, TypeError, EOFError):
+                continue  # fremde oder unvollständige Datei
+            eintraege.append({
+                'name': name,
+                'erstellt': erstellt,
+                'funktion': '_'.join(teile[1:-1]),
+                'groesse': os.path.getsize(pfad),
+                'dauer': dauer,
+            })
+        return sorted(eintraege, key=lambda e: e['erstellt'], reverse=True)
+
+    def auswertung(self, name):
+        """Textauswertung eines Profils (Top-Funktionen nach kumulierter Zeit)"""
+        ausgabe = io.StringIO()
+        stats = pstats.Stats(os.path.join(self.verzeichnis, name), stream=ausgabe)
+        stats.strip_dirs().sort_stats(AUSWERTUNG_SORTIERUNG).print_stats(AUSWERTUNG_ZEILEN)
+        return ausgabe.getvalue()
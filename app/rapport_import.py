@@ -0,0 +1,234 @@
+"""Massenimport von Rapporten aus JSON oder CSV (z.B. Übernahme aus dem alten Tool)
+
+Zeilen werden blockweise geprüft: pro Block eine Abfrage für Kunden und
+Stundensätze, die Kosten fehlender Zeilen werden für den ganzen Block berechnet.
+Eingefügt wird mit executemany in einer einzigen Transaktion.
+"""
+import csv
+import json
+import math
+from datetime import date
+from functools import lru_cache
+from io import StringIO
+
+from app.database import get_db
+
+# Zeilen pro Block (eine Kundenabfrage pro Block, bleibt unter dem SQLite-Parameterlimit)
+IMPORT_BLOCKGROESSE = 500
+
+# Spaltennamen (klein geschrieben) -> Feld; akzeptiert auch die Kopfzeile des CSV-Exports
+FELDNAMEN = {
+    'datum': 'datum',
+    'kunde_id': 'kunde_id',
+    'kunde': 'kunde',
+    'thema': 'thema',
+    'dauer_minuten': 'dauer_minuten',
+    'dauer': 'dauer_minuten',
+    'dauer (min)': 'dauer_minuten',
+    'kosten': 'kosten',
+    'kosten (chf)': 'kosten',
+    'bezahlt': 'bezahlt',
+    'zahlungsart': 'zahlungsart',
+}
+
+WAHR = {'1', 'true', 'ja', 'yes', 'x', 'bezahlt'}
+FALSCH = {'', '0', 'false', 'nein', 'no', 'offen'}
+
+INSERT_SQL = ('INSERT INTO rapporte (kunde_id, datum, dauer_minuten, thema, kosten, bezahlt, zahlungsart) '
+              'VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+class ImportFehler(ValueError):
+    """Ungültige Importdaten (ganze Datei oder einzelne Zeile)"""
+
+def lese_json(text):
+    """Liste von Rapporten aus JSON (Liste oder {"rapporte": [...]})"""
+    try:
+        daten = json.loads(text)
+    except ValueError as e:
+        raise ImportFehler(f"Ungültiges JSON: {e}") from e
+    if isinstance(daten, dict):
+        daten = daten.get('rapporte')
+    if not isinstance(daten, list):
+        raise ImportFehler("JSON muss eine Liste von Rapporten oder {\"rapporte\": [...]} enthalten")
+    return daten
+
+def lese_csv(text):
+    """Rapporte aus CSV mit Kopfzeile (Trennzeichen ; , oder Tab)"""
+    text = text.lstrip('\ufeff')
+    try:
+        trennzeichen = csv.Sniffer().sniff(text.partition('\n')[0], delimiters=';,\t').delimiter
+    except csv.Error:
+        trennzeichen = ';'  # wie der CSV-Export
+    return list(csv.DictReader(StringIO(text), delimiter=trennzeichen))
+
+@lru_cache(maxsize=256)
+def _feld(name):
+    return FELDNAMEN.get(str(name).strip().lower())
+
+def _normalisiere(zeile):
+    if not isinstance(zeile, dict):
+        raise ImportFehler("Eintrag ist kein Objekt")
+    felder = {}
+    for name, wert in zeile.items():
+        feld = _feld(name)
+        if feld:
+            felder[feld] = wert.strip() if isinstance(wert, str) else wert
+    return felder
+
+def _datum(wert):
+    """YYYY-MM-DD oder DD.MM.YYYY -> YYYY-MM-DD (ohne strptime, das bei grossen Importen dominiert)"""
+    text = str(wert)
+    try:
+        if '.' in text:
+            tag, monat, jahr = text.split('.')
+            if len(jahr) == 4:
+                return date(int(jahr), int(monat), int(tag)).isoformat()
+        elif len(text) == 10:
+            return date.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    raise ImportFehler(f"Ungültiges Datum: {wert!r}")
+
+def _zahl(wert, feld):
+    if isinstance(wert, (int, float)) and not isinstance(wert, bool):
+        zahl = float(wert)
+    else:
+        try:
+            zahl = float(str(wert).replace("'", '').replace(',', '.'))
+        except (ValueError, OverflowError):
+            raise ImportFehler(f"Ungültige Zahl in {feld}: {wert!r}") from None
+    # nan, inf und Überläufe wie 1e400 (float gibt dafür inf zurück)
+    if not math.isfinite(zahl):
+        raise ImportFehler(f"Ungültige Zahl in {feld}: {wert!r}")
+    return zahl
+
+def _bezahlt(wert):
+    if isinstance(wert, bool) or wert is None:
+        return bool(wert)
+    text = str(wert).strip().lower()
+    if text in WAHR:
+        return True
+    if text in FALSCH:
+        return False
+    raise ImportFehler(f"Ungültiger Wert für bezahlt: {wert!r}")
+
+def pruefe_zeile(zeile):
+    """Prüft eine Zeile und gibt die Felder ohne Kundenzuordnung und Kosten zurück"""
+    felder = _normalisiere(zeile)
+    # JSON kann beliebige Typen liefern, CSV nur Text
+    for feld in ('kunde', 'datum', 'thema', 'zahlungsart'):
+        if felder.get(feld) is not None and not isinstance(felder[feld], str):
+            raise ImportFehler(f"{feld} muss Text sein: {felder[feld]!r}")
+    if not felder.get('kunde_id') and not felder.get('kunde'):
+        raise ImportFehler("kunde_id oder kunde fehlt")
+    if not felder.get('datum'):
+        raise ImportFehler("datum fehlt")
+    if not felder.get('thema'):
+        raise ImportFehler("thema fehlt")
+    if felder.get('dauer_minuten') in (None, ''):
+        raise ImportFehler("dauer_minuten fehlt")
+
+    dauer = _zahl(felder['dauer_minuten'], 'dauer_minuten')
+    if dauer <= 0 or dauer != int(dauer):
+        raise ImportFehler(f"dauer_minuten muss eine positive ganze Zahl sein: {felder['dauer_minuten']!r}")
+    kosten = felder.get('kosten')
+    kosten = None if kosten in (None, '') else _zahl(kosten, 'kosten')
+    if kosten is not None and kosten < 0:
+        raise ImportFehler(f"kosten darf nicht negativ sein: {felder['kosten']!r}")
+
+    kunde_id = felder.get('kunde_id')
+    if kunde_id not in (None, ''):
+        if isinstance(kunde_id, bool) or (isinstance(kunde_id, float) and not kunde_id.is_integer()):
+            raise ImportFehler(f"Ungültige kunde_id: {kunde_id!r}")
+        try:
+            kunde_id = int(kunde_id)
+        except (TypeError, ValueError, OverflowError):
+            raise ImportFehler(f"Ungültige kunde_id: {kunde_id!r}") from None
+    else:
+        kunde_id = None
+
+    return {
+        'kunde_id': kunde_id,
+        'kunde': str(felder.get('kunde') or ''),
+        'datum': _datum(felder['datum']),
+        'dauer_minuten': int(dauer),
+        'thema': str(felder['thema']),
+        'kosten': kosten,
+        'bezahlt': _bezahlt(felder.get('bezahlt')),
+        'zahlungsart': str(felder.get('zahlungsart') or ''),
+    }
+
+def _lade_kunden(db, block):
+    """Eine Abfrage pro Block: Kunden nach ID und Name mit Stundensatz"""
+    ids = sorted({z['kunde_id'] for _, z in block if z['kunde_id'] is not None})
+    namen = sorted({z['kunde'] for _, z in block if z['kunde_id'] is None})
+    if not ids and not namen:
+        return {}, {}
+    bedingungen, params = [], []
+    if ids:
+        bedingungen.append(f"id IN ({','.join('?' * len(ids))})")
+        params += ids
+    if namen:
+        bedingungen.append(f"name IN ({','.join('?' * len(namen))})")
+        params += namen
+    rows = db.execute(f"SELECT id, name, stundensatz FROM kunden WHERE {' OR '.join(bedingungen)}",
+                      params).fetchall()
+    nach_id = {row['id']: row for row in rows}
+    nach_name = {}
+    for row in rows:
+        nach_name.setdefault(row['name'], []).append(row)
+    return nach_id, nach_name
+
+def importiere_rapporte(zeilen, teilweise=False, nur_pruefen=False):
+    """Prüft und importiert Rapporte; gibt {'zeilen', 'importiert', 'fehler': [{'zeile', 'fehler'}]} zurück
+
+    Zeilennummern zählen ab 1 ohne Kopfzeile. Ohne teilweise wird bei einem
+    Fehler nichts importiert, mit teilweise werden die gültigen Zeilen übernommen.
+    """
+    db = get_db()
+    werte, fehler = [], []
+    for start in range(0, len(zeilen), IMPORT_BLOCKGROESSE):
+        block = []
+        for nummer, zeile in enumerate(zeilen[start:start + IMPORT_BLOCKGROESSE], start=start + 1):
+            try:
+                block.append((nummer, pruefe_zeile(zeile)))
+            except ImportFehler as e:
+                fehler.append({'zeile': nummer, 'fehler': str(e)})
+
+        nach_id, nach_name = _lade_kunden(db, block)
+        zugeordnet = []
+        for nummer, z in block:
+            if z['kunde_id'] is not None:
+                kunde = nach_id.get(z['kunde_id'])
+                if kunde is None:
+                    fehler.append({'zeile': nummer, 'fehler': f"Kunde {z['kunde_id']} nicht gefunden"})
+                    continue
+            else:
+                treffer = nach_name.get(z['kunde'], [])
+                if len(treffer) != 1:
+                    meldung = 'nicht gefunden' if not treffer else 'nicht eindeutig, bitte kunde_id angeben'
+                    fehler.append({'zeile': nummer, 'fehler': f"Kunde {z['kunde']!r} {meldung}"})
+                    continue
+                kunde = treffer[0]
+            zugeordnet.append((z, kunde))
+
+        # Kosten aller Zeilen ohne Betrag in einem Durchgang aus Dauer und Stundensatz
+        kosten = [z['kosten'] if z['kosten'] is not None
+                  else round(z['dauer_minuten'] / 60.0 * (kunde['stundensatz'] or 120.0), 2)
+                  for z, kunde in zugeordnet]
+        werte += [(kunde['id'], z['datum'], z['dauer_minuten'], z['thema'], betrag, z['bezahlt'], z['zahlungsart'])
+                  for (z, kunde), betrag in zip(zugeordnet, kosten)]
+
+    fehler.sort(key=lambda f: f['zeile'])
+    ergebnis = {'zeilen': len(zeilen), 'importiert': 0, 'fehler': fehler}
+    if nur_pruefen or not werte or (fehler and not teilweise):
+        return ergebnis
+
+    try:
+        db.executemany(INSERT_SQL, werte)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    ergebnis['importiert'] = len(werte)
+    return ergebnis
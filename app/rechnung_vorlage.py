@@ -0,0 +1,118 @@
+"""Vorlagen für PDF-Rechnungen und -Exporte
+
+Styles, Tabellen-Styles und der Absender-Kopf werden einmal beim Import
+aufgebaut und für jedes Dokument wiederverwendet, statt pro Request neu.
+"""
+import copy
+from functools import lru_cache
+
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Paragraph, Spacer, TableStyle
+
+# Paragraph-Styles (werden nur gelesen, daher zwischen Dokumenten teilbar)
+STYLES = getSampleStyleSheet()
+
+# Seitenränder aller Dokumente
+SEITENRAENDER = {
+    'rightMargin': 2*cm,
+    'leftMargin': 2*cm,
+    'topMargin': 2*cm,
+    'bottomMargin': 2*cm
+}
+
+def _positionen_stil(kopf_farbe):
+    """Tabellen-Style für Rechnungspositionen mit Total-Zeile"""
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), kopf_farbe),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('ALIGN', (4, 0), (4, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),  # Text oben ausrichten (für mehrzeilige Beschreibung)
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -2), 1, colors.black),
+        ('LINEABOVE', (3, -1), (-1, -1), 2, colors.black),
+        ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold'),  # Total-Zeile fett
+    ])
+
+# Einzelrechnung, offene und bezahlte Positionen der konsolidierten Rechnung
+POSITIONEN_STIL = _positionen_stil(colors.grey)
+OFFENE_POSITIONEN_STIL = _positionen_stil(colors.HexColor('#cc0000'))
+BEZAHLTE_POSITIONEN_STIL = _positionen_stil(colors.HexColor('#228B22'))
+
+ZUSAMMENFASSUNG_STIL = TableStyle([
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('LINEABOVE', (0, -1), (-1, -1), 2, colors.black),
+    ('TOPPADDING', (0, -1), (-1, -1), 8),
+])
+
+EXPORT_STIL = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+    ('GRID', (0, 0), (-1, -2), 1, colors.black),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+])
+
+# Seitenblöcke des PDF-Exports (ohne Total-Zeile)
+EXPORT_BLOCK_STIL = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+class NachladendeFlowables(list):
+    """Flowable-Liste für doc.build(), die bei Bedarf aus einem Iterator nachgeladen wird
+
+    platypus entnimmt die Flowables vorne (del flowables[0]); die Liste hält nur
+    einen kleinen Puffer, damit grosse Exporte nicht komplett im Speicher liegen.
+    """
+
+    def __init__(self, flowables, puffer=4):
+        super().__init__()
+        self._quelle = iter(flowables)
+        self._puffer = puffer
+        self._nachladen()
+
+    def _nachladen(self):
+        while self._quelle is not None and len(self) < self._puffer:
+            try:
+                self.append(next(self._quelle))
+            except StopIteration:
+                self._quelle = None
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._nachladen()
+
+@lru_cache(maxsize=8)
+def _absender_paragraphen(display_name, address_line1, address_line2):
+    """Geparste Absender-Paragraphen (Markup wird nur einmal geparst)"""
+    return (
+        Paragraph(f'<b>{display_name}</b>', STYLES['Title']),
+        Paragraph(address_line1, STYLES['Normal']),
+        Paragraph(address_line2, STYLES['Normal']),
+    )
+
+def absender_kopf(payee):
+    """Absender-Block für Rechnungen als Liste von Flowables
+
+    Liefert flache Kopien der vorbereiteten Paragraphen: das Layout (wrap/split)
+    speichert Zustand am Objekt, das geparste Markup wird dagegen geteilt.
+    """
+    paragraphen = _absender_paragraphen(payee['display_name'], payee['address_line1'], payee['address_line2'])
+    return [copy.copy(p) for p in paragraphen] + [Spacer(1, 1*cm)]
@@ -0,0 +1,120 @@
+"""Rechnungslauf: konsolidierte Rechnungen für alle Kunden mit offenen Rapporten"""
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from app.database import get_db
+from app.main import (
+    PAYEE_CONFIG, erstelle_konsolidierte_rechnung_pdf, reserviere_rechnung, gib_rechnung_frei,
+    lade_rechnungs_kunde, lade_rechnungs_rapporte, berechne_eingabe_hash,
+    finde_gespeicherte_rechnung, hinterlege_rechnung_pdf, rechnung_pdf_pfad
+)
+
+
+def _rendere_rechnung(kunde, rapporte, rechnungs_nummer):
+    """Worker: rendert eine konsolidierte Rechnung (läuft im Prozess-Pool)"""
+    start = time.perf_counter()
+    pdf_bytes = erstelle_konsolidierte_rechnung_pdf(rapporte, kunde, rechnungs_nummer)
+    return pdf_bytes, time.perf_counter() - start
+
+
+def _dateiname(rechnungs_nummer, kunde):
+    """Dateiname für das PDF im Ausgabeverzeichnis"""
+    name = re.sub(r'[^A-Za-z0-9ÄÖÜäöüéèà_-]+', '_', kunde['name']).strip('_')
+    return f"{rechnungs_nummer}_{name}.pdf"
+
+
+def kunden_mit_offenen_rapporten(von_datum='', bis_datum=''):
+    """IDs aller Kunden mit offenen Rapporten im Zeitraum"""
+    query = 'SELECT DISTINCT kunde_id FROM rapporte WHERE bezahlt = 0'
+    params = []
+    if von_datum:
+        query += ' AND datum >= ?'
+        params.append(von_datum)
+    if bis_datum:
+        query += ' AND datum <= ?'
+        params.append(bis_datum)
+    query += ' ORDER BY kunde_id'
+    return [row['kunde_id'] for row in get_db().execute(query, params).fetchall()]
+
+
+def fuehre_rechnungslauf(von_datum, bis_datum, ausgabe_dir, workers=None, melde=print):
+    """Erstellt konsolidierte Rechnungen parallel, legt PDFs und ZIP-Bundle ab
+
+    Muss innerhalb eines App-Kontexts laufen. Rechnungsnummern werden vorab im
+    Hauptprozess reserviert, nur das Rendern läuft im Prozess-Pool.
+    """
+    if not PAYEE_CONFIG['iban']:
+        raise ValueError("PAYEE_IBAN nicht konfiguriert")
+
+    lauf_start = time.perf_counter()
+    os.makedirs(ausgabe_dir, exist_ok=True)
+
+    # 1. Aufträge sammeln und Rechnungsnummern reservieren
+    auftraege = []
+    dateien = []
+    for kunde_id in kunden_mit_offenen_rapporten(von_datum, bis_datum):
+        kunde = lade_rechnungs_kunde(kunde_id)
+        rapporte = lade_rechnungs_rapporte(kunde_id, von_datum, bis_datum)
+        if not kunde or not rapporte:
+            continue
+
+        eingabe_hash = berechne_eingabe_hash('konsolidiert', rapporte, kunde)
+        vorhanden = finde_gespeicherte_rechnung(eingabe_hash)
+        if vorhanden:
+            # Unveränderte Rechnung: gespeichertes PDF übernehmen
+            dateiname = _dateiname(vorhanden['rechnungs_nummer'], kunde)
+            with open(rechnung_pdf_pfad(vorhanden['pdf_hash']), 'rb') as f:
+                pdf_bytes = f.read()
+            with open(os.path.join(ausgabe_dir, dateiname), 'wb') as f:
+                f.write(pdf_bytes)
+            dateien.append(dateiname)
+            melde(f"  = {kunde['name']}: {vorhanden['rechnungs_nummer']} (unverändert)")
+            continue
+
+        total_offen = sum(r['kosten'] for r in rapporte if not r['bezahlt'])
+        rapport_ids = [r['id'] for r in rapporte]
+        rechnungs_nummer = reserviere_rechnung(kunde_id, total_offen, rapport_ids, eingabe_hash, 'konsolidiert')
+        auftraege.append((kunde, rapporte, rechnungs_nummer))
+
+    melde(f"{len(auftraege)} Rechnungen zu erstellen, {len(dateien)} unverändert")
+
+    # 2. PDFs parallel rendern
+    fehler = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_rendere_rechnung, kunde, rapporte, rechnungs_nummer): (kunde, rechnungs_nummer)
+            for kunde, rapporte, rechnungs_nummer in auftraege
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            kunde, rechnungs_nummer = futures[future]
+            try:
+                pdf_bytes, dauer = future.result()
+            except Exception as e:
+                # Nummer freigeben: die nächste Rechnung des Kunden übernimmt sie
+                gib_rechnung_frei(rechnungs_nummer)
+                fehler.append((kunde['name'], str(e)))
+                melde(f"[{i}/{len(auftraege)}] ✗ {kunde['name']}: {rechnungs_nummer} freigegeben, {e}")
+                continue
+
+            hinterlege_rechnung_pdf(rechnungs_nummer, pdf_bytes)
+
+            dateiname = _dateiname(rechnungs_nummer, kunde)
+            with open(os.path.join(ausgabe_dir, dateiname), 'wb') as f:
+                f.write(pdf_bytes)
+            dateien.append(dateiname)
+            melde(f"[{i}/{len(auftraege)}] ✓ {kunde['name']}: {rechnungs_nummer} ({dauer:.2f}s)")
+
+    # 3. ZIP-Bundle
+    zip_pfad = os.path.join(ausgabe_dir, f"Rechnungslauf_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+    with zipfile.ZipFile(zip_pfad, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for dateiname in sorted(dateien):
+            zf.write(os.path.join(ausgabe_dir, dateiname), arcname=dateiname)
+
+    melde(f"Fertig: {len(dateien)} Rechnungen, {len(fehler)} Fehler, "
+          f"{time.perf_counter() - lauf_start:.1f}s → {zip_pfad}")
+
+    return {'dateien': dateien, 'fehler': fehler, 'zip': zip_pfad}
@@ -0,0 +1,101 @@
+"""Laufende Salden pro Kunde (Tabelle kunden_saldo, per Trigger auf rapporte gepflegt)
+
+Beträge werden in Rappen als Ganzzahl summiert, damit die laufenden Summen nicht
+durch Rundungsfehler von REAL-Additionen abdriften. Kunden ohne Rapporte haben
+keine Zeile (LEFT JOIN mit COALESCE).
+"""
+
+# Betrag eines Rapports in Rappen (kosten ist REAL in CHF)
+def _rappen(zeile):
+    return f"CAST(ROUND(COALESCE({zeile}.kosten, 0) * 100) AS INTEGER)"
+
+def _offen(zeile, wert):
+    return f"CASE WHEN {zeile}.bezahlt THEN 0 ELSE {wert} END"
+
+def _bezahlt(zeile, wert):
+    return f"CASE WHEN {zeile}.bezahlt THEN {wert} ELSE 0 END"
+
+def _abziehen(zeile):
+    """UPDATE-Statement: Beiträge eines alten Rapports entfernen, letztes Datum neu bestimmen"""
+    return f'''UPDATE kunden_saldo SET
+            offen_rappen = offen_rappen - {_offen(zeile, _rappen(zeile))},
+            bezahlt_rappen = bezahlt_rappen - {_bezahlt(zeile, _rappen(zeile))},
+            offen_minuten = offen_minuten - {_offen(zeile, f'{zeile}.dauer_minuten')},
+            anzahl_rapporte = anzahl_rapporte - 1,
+            letzter_rapport = (SELECT MAX(datum) FROM rapporte WHERE kunde_id = {zeile}.kunde_id)
+        WHERE kunde_id = {zeile}.kunde_id;'''
+
+def _addieren(zeile):
+    """INSERT + UPDATE: Beiträge eines neuen Rapports addieren"""
+    return f'''INSERT OR IGNORE INTO kunden_saldo (kunde_id) VALUES ({zeile}.kunde_id);
+        UPDATE kunden_saldo SET
+            offen_rappen = offen_rappen + {_offen(zeile, _rappen(zeile))},
+            bezahlt_rappen = bezahlt_rappen + {_bezahlt(zeile, _rappen(zeile))},
+            offen_minuten = offen_minuten + {_offen(zeile, f'{zeile}.dauer_minuten')},
+            anzahl_rapporte = anzahl_rapporte + 1,
+            letzter_rapport = MAX(COALESCE(letzter_rapport, {zeile}.datum), {zeile}.datum)
+        WHERE kunde_id = {zeile}.kunde_id;'''
+
+SALDO_TABELLE = '''
+    CREATE TABLE IF NOT EXISTS kunden_saldo (
+        kunde_id INTEGER PRIMARY KEY,
+        offen_rappen INTEGER NOT NULL DEFAULT 0,
+        bezahlt_rappen INTEGER NOT NULL DEFAULT 0,
+        offen_minuten INTEGER NOT NULL DEFAULT 0,
+        anzahl_rapporte INTEGER NOT NULL DEFAULT 0,
+        letzter_rapport DATE,
+        FOREIGN KEY (kunde_id) REFERENCES kunden (id) ON DELETE CASCADE
+    )
+'''
+
+# letzter_rapport: beim Hinzufügen direkt, beim Entfernen per MAX(datum) über idx_rapporte_kunde_datum
+SALDO_TRIGGER = [
+    f'''CREATE TRIGGER IF NOT EXISTS kunden_saldo_insert AFTER INSERT ON rapporte BEGIN
+        {_addieren('new')}
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS kunden_saldo_delete AFTER DELETE ON rapporte BEGIN
+        {_abziehen('old')}
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS kunden_saldo_update
+        AFTER UPDATE OF kunde_id, datum, dauer_minuten, kosten, bezahlt ON rapporte BEGIN
+        {_abziehen('old')}
+        {_addieren('new')}
+    END''',
+]
+
+# Salden aus allen Rapporten berechnet (Neuaufbau und Prüfung)
+SALDO_BERECHNUNG_SQL = f'''
+    SELECT r.kunde_id,
+           SUM({_offen('r', _rappen('r'))}) as offen_rappen,
+           SUM({_bezahlt('r', _rappen('r'))}) as bezahlt_rappen,
+           SUM({_offen('r', 'r.dauer_minuten')}) as offen_minuten,
+           COUNT(*) as anzahl_rapporte,
+           MAX(r.datum) as letzter_rapport
+    FROM rapporte r
+    GROUP BY r.kunde_id
+'''
+
+SALDO_SPALTEN = ('offen_rappen', 'bezahlt_rappen', 'offen_minuten', 'anzahl_rapporte', 'letzter_rapport')
+
+def baue_salden_neu(db):
+    """Ersetzt alle Salden durch neu berechnete Werte (ohne Commit)"""
+    db.execute('DELETE FROM kunden_saldo')
+    db.execute(f'''
+        INSERT INTO kunden_saldo (kunde_id, {', '.join(SALDO_SPALTEN)})
+        SELECT kunde_id, {', '.join(SALDO_SPALTEN)} FROM ({SALDO_BERECHNUNG_SQL})
+        WHERE kunde_id IN (SELECT id FROM kunden)
+    ''')
+
+def pruefe_salden(db):
+    """Vergleicht gespeicherte mit neu berechneten Salden, gibt Abweichungen zurück"""
+    gespeichert = {row['kunde_id']: row for row in db.execute('SELECT * FROM kunden_saldo').fetchall()}
+    berechnet = {row['kunde_id']: row for row in db.execute(SALDO_BERECHNUNG_SQL).fetchall()}
+    abweichungen = []
+    for kunde_id in sorted(gespeichert.keys() | berechnet.keys()):
+        soll, ist = berechnet.get(kunde_id), gespeichert.get(kunde_id)
+        for spalte in SALDO_SPALTEN:
+            soll_wert = soll[spalte] if soll else (None if spalte == 'letzter_rapport' else 0)
+            ist_wert = ist[spalte] if ist else (None if spalte == 'letzter_rapport' else 0)
+            if str(soll_wert) != str(ist_wert):
+                abweichungen.append({'kunde_id': kunde_id, 'spalte': spalte, 'soll': soll_wert, 'ist': ist_wert})
+    return abweichungen
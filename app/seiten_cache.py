@@ -0,0 +1,94 @@
+"""Cache gerenderter Seiten mit ETag (Übersicht, Kundenliste, Kundendetail)
+
+Schlüssel sind Route, Pfad- und Query-Argumente und der Datenstand. Der Datenstand
+ist ein zufälliges Token in einer Datei neben der Datenbank, das jeder Schreibzugriff
+ersetzt, dadurch sehen auch andere Prozesse (gunicorn-Worker, Job-Worker,
+Rechnungslauf) Änderungen sofort. Ein If-None-Match mit dem aktuellen ETag wird mit
+304 beantwortet, ohne SQLite abzufragen oder ein Template zu rendern.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+class SeitenCache:
+    """Gerenderte Antworten pro Prozess (LRU), gültig bis zum nächsten Datenstand"""
+
+    def __init__(self, datei, groesse=128):
+        self.datei = datei
+        self.groesse = groesse
+        self._eintraege = OrderedDict()
+        self._stand = None
+        self._lock = threading.Lock()
+        self.statistik = {'treffer': 0, 'nicht_geaendert': 0, 'gerendert': 0}
+
+    def datenstand(self):
+        """Aktueller Datenstand (legt die Datei beim ersten Zugriff an)"""
+        try:
+            with open(self.datei, encoding='ascii') as f:
+                return f.read()
+        except FileNotFoundError:
+            return self.invalidieren()
+
+    def invalidieren(self):
+        """Neuer Datenstand nach einem Schreibzugriff (verwirft die Seiten aller Prozesse)"""
+        stand = os.urandom(8).hex()
+        os.makedirs(os.path.dirname(self.datei) or '.', exist_ok=True)
+        temp = f"{self.datei}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp, 'w', encoding='ascii') as f:
+            f.write(stand)
+        os.replace(temp, self.datei)  # atomar, Leser sehen nie eine halbe Datei
+        return stand
+
+    def status(self):
+        with self._lock:
+            return dict(self.statistik, eintraege=len(self._eintraege))
+
+    def _antwort(self, etag, status=200, daten=b'', mimetype=None):
+        antwort = Response(daten, status=status, mimetype=mimetype)
+        antwort.set_etag(etag)
+        # Browser fragt jedes Mal nach (304), zeigt aber nie veraltete Daten
+        antwort.headers['Cache-Control'] = 'private, no-cache'
+        return antwort
+
+    def seite(self, funktion):
+        """Dekorator für GET-Routen (unter @auth.login_required)"""
+        @wraps(funktion)
+        def gecacht(*args, **kwargs):
+            if self.groesse <= 0:
+                return funktion(*args, **kwargs)
+
+            stand = self.datenstand()
+            schluessel = '\0'.join((request.endpoint, repr(sorted(kwargs.items())),
+                                    request.query_string.decode('latin-1'), stand))
+            etag = hashlib.sha256(schluessel.encode('utf-8')).hexdigest()[:32]
+
+            with self._lock:
+                if stand != self._stand:
+                    # Neuer Datenstand: alle Seiten dieses Prozesses sind veraltet
+                    self._eintraege.clear()
+                    self._stand = stand
+                if request.if_none_match.contains(etag):
+                    self.statistik['nicht_geaendert'] += 1
+                    return self._antwort(etag, status=304)
+                eintrag = self._eintraege.get(etag)
+                if eintrag is not None:
+                    self._eintraege.move_to_end(etag)
+                    self.statistik['treffer'] += 1
+                    return self._antwort(etag, 200, *eintrag)
+
+            antwort = make_response(funktion(*args, **kwargs))
+            if antwort.status_code != 200 or antwort.is_streamed:
+                return antwort
+            eintrag = (antwort.get_data(), antwort.mimetype)
+            with self._lock:
+                self.statistik['gerendert'] += 1
+                if stand == self._stand:
+                    self._eintraege[etag] = eintrag
+                    while len(self._eintraege) > self.groesse:
+                        self._eintraege.popitem(last=False)
+            return self._antwort(etag, 200, *eintrag)
+        return gecacht
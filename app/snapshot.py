@@ -0,0 +1,119 @@
+"""Lesekopie der Datenbank für Exporte und Auswertung (optional, SNAPSHOT=1)
+
+Die Kopie entsteht mit der Backup-API von sqlite3 in einer temporären Datei und
+ersetzt die alte per os.replace. Offene Verbindungen lesen die alte Datei zu Ende,
+neue sehen die neue. Lange Exporte halten dadurch keine Lesetransaktion auf der
+Hauptdatenbank, die Checkpoints des WAL aufhält und mit Schreibzugriffen um
+Cache und Platte konkurriert.
+
+Aktuell ist die Kopie, solange sich der Datenstand (siehe app/seiten_cache.py)
+nicht geändert hat; nach Änderungen wird sie höchstens max_alter Sekunden
+weiterverwendet und sonst beim nächsten Zugriff erneuert.
+"""
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+# PRAGMAs der read-only Verbindungen auf die Kopie
+SNAPSHOT_PRAGMAS = [
+    'PRAGMA query_only = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA cache_size = -16000',
+]
+
+class Snapshot:
+    """Lesekopie einer SQLite-Datenbank, erneuert bei Bedarf"""
+
+    def __init__(self, quelle, datei, datenstand, max_alter=300):
+        self.quelle = quelle
+        self.datei = datei
+        self.datenstand = datenstand
+        self.max_alter = max_alter
+        self._lock = threading.Lock()
+        self._erneuern_lock = threading.Lock()
+        self.statistik = {'erneuert': 0, 'letzte_dauer_ms': None}
+
+    def erneuern(self):
+        """Kopiert die Hauptdatenbank in einer Lesetransaktion und ersetzt die Kopie"""
+        start = time.perf_counter()
+        # Datenstand vor dem Kopieren: spätere Änderungen machen die Kopie veraltet
+        stand = self.datenstand()
+        erstellt = time.time()
+        os.makedirs(os.path.dirname(self.datei) or '.', exist_ok=True)
+        temp = f"{self.datei}.{os.getpid()}.{threading.get_ident()}.tmp"
+        quelle = sqlite3.connect(self.quelle, timeout=5)
+        ziel = sqlite3.connect(temp)
+        try:
+            quelle.backup(ziel)  # in einem Schritt: konsistenter Stand, blockiert Schreiber im WAL nicht
+            ziel.execute('PRAGMA journal_mode = DELETE')  # read-only ohne -wal/-shm lesbar
+            ziel.execute('CREATE TABLE snapshot_info (datenstand TEXT, erstellt REAL)')
+            ziel.execute('INSERT INTO snapshot_info VALUES (?, ?)', (stand, erstellt))
+            ziel.commit()
+        except BaseException:
+            ziel.close()
+            os.remove(temp)
+            raise
+        finally:
+            quelle.close()
+        ziel.close()
+        os.replace(temp, self.datei)
+
+        dauer_ms = round((time.perf_counter() - start) * 1000, 1)
+        with self._lock:
+            self.statistik['erneuert'] += 1
+            self.statistik['letzte_dauer_ms'] = dauer_ms
+        return dauer_ms
+
+    def _oeffne(self, factory):
+        # immutable: die Datei wird nie verändert, nur ersetzt (kein Locking nötig)
+        conn = sqlite3.connect(
+            f"file:{quote(os.path.abspath(self.datei))}?mode=ro&immutable=1",
+            uri=True,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            factory=factory
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in SNAPSHOT_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _aktuell(self, conn):
+        info = conn.execute('SELECT datenstand, erstellt FROM snapshot_info').fetchone()
+        return info['datenstand'] == self.datenstand() or time.time() - info['erstellt'] < self.max_alter
+
+    def _oeffne_aktuelle(self, factory):
+        if not os.path.exists(self.datei):
+            return None
+        conn = self._oeffne(factory)
+        try:
+            if self._aktuell(conn):
+                return conn
+        except sqlite3.DatabaseError:
+            pass  # unvollständige oder fremde Datei: neu erstellen
+        conn.close()
+        return None
+
+    def verbindung(self, factory=sqlite3.Connection):
+        """Read-only Verbindung auf eine aktuelle Kopie (erneuert sie bei Bedarf)"""
+        conn = self._oeffne_aktuelle(factory)
+        if conn is not None:
+            return conn
+        with self._erneuern_lock:
+            # Ein Thread erneuert, die übrigen verwenden danach dessen Kopie
+            conn = self._oeffne_aktuelle(factory)
+            if conn is None:
+                self.erneuern()
+                conn = self._oeffne(factory)
+        return conn
+
+    def status(self):
+        try:
+            alter = round(time.time() - os.stat(self.datei).st_mtime)
+        except FileNotFoundError:
+            alter = None
+        with self._lock:
+            return dict(self.statistik, alter_s=alter, max_alter=self.max_alter)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Benchmark der Haupt-Routen mit synthetischen Daten in einer temporären Datenbank
+
+Verwendung:
+    python3 benchmark.py [--kunden 1000] [--rapporte 500000] [--wiederholungen 20] [--ausgabe ergebnis.json]
+
+Erzeugt die Daten, ruft die Routen über den Flask-Test-Client auf und gibt
+Latenz-Perzentile, Anzahl SQL-Statements und Peak-RSS pro Route als JSON aus.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from base64 import b64encode
+from datetime import date, datetime, timedelta
+
+# Temporäre Datenbank, Test-Zahlungsempfänger und Zugangsdaten, bevor die App importiert wird
+ARBEITSVERZEICHNIS = tempfile.mkdtemp(prefix='rapporte-benchmark-')
+os.environ['DATABASE_PATH'] = os.path.join(ARBEITSVERZEICHNIS, 'benchmark.db')
+os.environ['RECHNUNGEN_DIR'] = os.path.join(ARBEITSVERZEICHNIS, 'rechnungen')
+# Gemessen wird das Rendern, nicht der Seiten-Cache (mit SEITEN_CACHE_GROESSE=128 vergleichen)
+os.environ.setdefault('SEITEN_CACHE_GROESSE', '0')
+os.environ.setdefault('PAYEE_IBAN', 'CH9300762011623852957')
+os.environ.setdefault('PAYEE_LEGAL_NAME', 'Benchmark GmbH')
+os.environ.setdefault('PAYEE_DISPLAY_NAME', 'Benchmark GmbH')
+os.environ.setdefault('PAYEE_ADDRESS_LINE1', 'Bahnhofstrasse 1')
+os.environ.setdefault('PAYEE_ADDRESS_LINE2', '8001 Zürich')
+
+BENUTZER = 'benchmark'
+PASSWORT = 'benchmark'
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+os.environ['AUTH_USERNAME'] = BENUTZER
+os.environ['AUTH_PASSWORD_HASH'] = generate_password_hash(PASSWORT)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app import main  # noqa: E402
+from app.database import get_db, get_pool  # noqa: E402
+
+THEMEN = [
+    'Email-Konfiguration Outlook',
+    'WLAN-Problem behoben',
+    'Drucker Installation und Einrichtung\nTreiber aktualisiert\nTestseite gedruckt',
+    'Backup-System konfiguriert',
+    'Virus entfernt und System gesichert',
+    'Software-Update durchgeführt',
+    'VPN-Zugang eingerichtet',
+    'Festplatte ersetzt\nDaten vom alten Laufwerk übernommen',
+    'Router neu konfiguriert',
+    'Datenmigration auf neuen PC',
+]
+ZAHLUNGSARTEN = ['Bar', 'Rechnung', 'Twint', 'Überweisung']
+STAEDTE = [('8001', 'Zürich'), ('3011', 'Bern'), ('4051', 'Basel'), ('6003', 'Luzern'), ('9000', 'St. Gallen')]
+
+def erzeuge_daten(pfad, anzahl_kunden, anzahl_rapporte, rng):
+    """Füllt die Datenbank mit Kunden und Rapporten (eine Transaktion, executemany)"""
+    conn = sqlite3.connect(pfad)
+    conn.execute('PRAGMA synchronous = OFF')
+
+    kunden = []
+    for i in range(1, anzahl_kunden + 1):
+        plz, stadt = rng.choice(STAEDTE)
+        kunden.append((i, f'Kunde {i:05d} AG', f'info@kunde{i}.ch', f'044 {i:03d} 00 00',
+                       'Bahnhofstrasse', str(rng.randint(1, 99)), plz, stadt,
+                       'Windows 11 PC, Drucker, Router', rng.choice([90.0, 120.0, 150.0])))
+    conn.executemany(
+        'INSERT INTO kunden (id, name, email, telefon, strasse, hausnummer, plz, stadt, it_infrastruktur, stundensatz) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', kunden)
+    stundensaetze = {k[0]: k[9] for k in kunden}
+
+    heute = date.today()
+    def rapporte():
+        for _ in range(anzahl_rapporte):
+            kunde_id = rng.randint(1, anzahl_kunden)
+            dauer = rng.choice([30, 45, 60, 90, 120, 180])
+            bezahlt = rng.random() < 2 / 3
+            yield (kunde_id, (heute - timedelta(days=rng.randint(0, 5 * 365))).isoformat(), dauer,
+                   rng.choice(THEMEN), round(dauer * stundensaetze[kunde_id] / 60, 2),
+                   int(bezahlt), rng.choice(ZAHLUNGSARTEN) if bezahlt else None)
+    conn.executemany(
+        'INSERT INTO rapporte (kunde_id, datum, dauer_minuten, thema, kosten, bezahlt, zahlungsart) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', rapporte())
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+def szenarien(anzahl_kunden, wiederholungen, rng):
+    """Routen und URL-Generatoren; Rechnungen jeweils für andere Kunden/Rapporte (kein PDF-Cache)"""
+    conn = sqlite3.connect(os.environ['DATABASE_PATH'])
+    offene_ids = [row[0] for row in conn.execute('SELECT id FROM rapporte WHERE bezahlt = 0 ORDER BY id')]
+    # Cursor für eine Folgeseite der Übersicht (Keyset-Pagination)
+    cursor = conn.execute('SELECT datum, id FROM rapporte ORDER BY datum DESC, id DESC LIMIT 1 OFFSET 1000').fetchone()
+    conn.close()
+    offene_rapporte = rng.sample(offene_ids, min(len(offene_ids), wiederholungen + 1))
+    kunden_ids = rng.sample(range(1, anzahl_kunden + 1), anzahl_kunden)
+    zufalls_kunde = lambda: rng.randint(1, anzahl_kunden)
+
+    return [
+        ('index', lambda: '/'),
+        ('index_folgeseite', lambda: f'/?nach={cursor[0]}_{cursor[1]}' if cursor else '/'),
+        ('index_offen', lambda: '/?bezahlt=0'),
+        ('index_kunde', lambda: f'/?kunde_id={zufalls_kunde()}'),
+        ('kunden_liste', lambda: '/kunden'),
+        ('kunde_detail', lambda: f'/kunden/{zufalls_kunde()}'),
+        ('export_csv', lambda: '/export/csv'),
+        ('export_csv_kunde', lambda: f'/export/csv?kunde_id={zufalls_kunde()}'),
+        ('export_pdf_kunde', lambda: f'/export/pdf?kunde_id={zufalls_kunde()}'),
+        ('rechnung_einzeln', lambda: f'/rechnung/rapport/{offene_rapporte.pop()}'),
+        ('rechnung_konsolidiert', lambda: f'/rechnung/kunde/{kunden_ids.pop()}/konsolidiert'),
+    ]
+
+def perzentil(werte, p):
+    """Perzentil einer sortierten Liste (nächster Rang)"""
+    return werte[max(0, min(len(werte) - 1, round(p / 100 * len(werte)) - 1))]
+
+def peak_rss_mb():
+    """Höchster Speicherverbrauch des Prozesses bisher (Linux: ru_maxrss in KB)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def messe(client, url_fuer, wiederholungen, statements):
+    """Führt eine Route wiederholt aus und gibt Kennzahlen zurück"""
+    kopf = {'Authorization': 'Basic ' + b64encode(f'{BENUTZER}:{PASSWORT}'.encode()).decode()}
+    client.get(url_fuer(), headers=kopf).get_data()  # Aufwärmen (Templates, Auth-Cache)
+
+    zeiten, anzahl_sql, groessen = [], [], []
+    for _ in range(wiederholungen):
+        url = url_fuer()
+        statements.clear()
+        start = time.perf_counter()
+        response = client.get(url, headers=kopf)
+        daten = response.get_data()  # Streaming-Antworten vollständig lesen
+        zeiten.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url}: HTTP {response.status_code}')
+        anzahl_sql.append(len(statements))
+        groessen.append(len(daten))
+
+    zeiten.sort()
+    return {
+        'wiederholungen': wiederholungen,
+        'ms': {
+            'min': round(zeiten[0], 2),
+            'p50': round(statistics.median(zeiten), 2),
+            'p90': round(perzentil(zeiten, 90), 2),
+            'p95': round(perzentil(zeiten, 95), 2),
+            'p99': round(perzentil(zeiten, 99), 2),
+            'max': round(zeiten[-1], 2),
+            'mittel': round(statistics.fmean(zeiten), 2),
+        },
+        'sql_statements': {'p50': statistics.median(anzahl_sql), 'max': max(anzahl_sql)},
+        'antwort_bytes_p50': statistics.median(groessen),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--kunden', type=int, default=1000, help='Anzahl Kunden')
+    parser.add_argument('--rapporte', type=int, default=500000, help='Anzahl Rapporte')
+    parser.add_argument('--wiederholungen', type=int, default=20, help='Aufrufe pro Route')
+    parser.add_argument('--routen', help='Nur diese Routen messen (kommagetrennt)')
+    parser.add_argument('--seed', type=int, default=42, help='Startwert für die Zufallsdaten')
+    parser.add_argument('--ausgabe', help='JSON zusätzlich in diese Datei schreiben')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    erzeuge_daten(os.environ['DATABASE_PATH'], args.kunden, args.rapporte, rng)
+    print(f'{args.kunden} Kunden, {args.rapporte} Rapporte erzeugt '
+          f'({time.perf_counter() - start:.1f}s, {ARBEITSVERZEICHNIS})', file=sys.stderr)
+
+    # SQL-Statements pro Request zählen (Trace-Callback auf der Request-Verbindung)
+    statements = []
+    @main.app.before_request
+    def _zaehle_sql():
+        get_db().set_trace_callback(statements.append)
+
+    auswahl = set(args.routen.split(',')) if args.routen else None
+    ergebnis = {
+        'zeitpunkt': datetime.now().isoformat(timespec='seconds'),
+        'umgebung': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plattform': platform.platform(),
+        },
+        'daten': {'kunden': args.kunden, 'rapporte': args.rapporte, 'seed': args.seed},
+        'routen': {},
+    }
+    client = main.app.test_client()
+    for name, url_fuer in szenarien(args.kunden, args.wiederholungen, rng):
+        if auswahl and name not in auswahl:
+            continue
+        ergebnis['routen'][name] = messe(client, url_fuer, args.wiederholungen, statements)
+        werte = ergebnis['routen'][name]
+        print(f"{name:<24} p50 {werte['ms']['p50']:9.1f} ms   p95 {werte['ms']['p95']:9.1f} ms   "
+              f"SQL {werte['sql_statements']['p50']:>5}   RSS {werte['peak_rss_mb']} MB", file=sys.stderr)
+    ergebnis['peak_rss_mb'] = peak_rss_mb()
+
+    with main.app.app_context():
+        get_pool().schliessen()
+    shutil.rmtree(ARBEITSVERZEICHNIS, ignore_errors=True)
+
+    text = json.dumps(ergebnis, indent=2, ensure_ascii=False)
+    if args.ausgabe:
+        with open(args.ausgabe, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+if __name__ == '__main__':
+    main_cli()
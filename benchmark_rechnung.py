@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Micro-Benchmark: Renderzeit pro Rechnung (Einzel- und konsolidierte Rechnung)
+
+Verwendung:
+    python3 benchmark_rechnung.py [--anzahl 50] [--positionen 20]
+
+Läuft gegen eine temporäre Datenbank, benötigt keine echten Daten.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Temporäre Datenbank und Test-Zahlungsempfänger, bevor die App importiert wird
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+os.environ.setdefault('PAYEE_IBAN', 'CH9300762011623852957')
+os.environ.setdefault('PAYEE_LEGAL_NAME', 'Benchmark GmbH')
+os.environ.setdefault('PAYEE_DISPLAY_NAME', 'Benchmark GmbH')
+os.environ.setdefault('PAYEE_ADDRESS_LINE1', 'Bahnhofstrasse 1')
+os.environ.setdefault('PAYEE_ADDRESS_LINE2', '8001 Zürich')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from app import main  # noqa: E402
+
+KUNDE = {'id': 1, 'name': 'Müller AG', 'email': 'info@mueller-ag.ch',
+         'strasse': 'Bahnhofstrasse', 'hausnummer': '10', 'plz': '8001', 'stadt': 'Zürich'}
+
+def erzeuge_rapporte(anzahl):
+    """Rapporte mit mehrzeiligen Themen (wie <br/>-Absätze in echten Daten)"""
+    return [{
+        'id': i,
+        'datum': f"2026-01-{1 + i % 28:02d}",
+        'dauer_minuten': 60 + (i % 4) * 30,
+        'thema': 'Drucker Installation und Einrichtung\nTreiber aktualisiert\nTestseite gedruckt',
+        'kosten': 120.0 + i,
+        'bezahlt': i % 3 == 0,
+        'zahlungsart': 'Bar' if i % 3 == 0 else ''
+    } for i in range(anzahl)]
+
+def messe(name, funktion, anzahl):
+    """Führt funktion anzahl-mal aus und gibt Kennzahlen in ms aus"""
+    funktion()  # Aufwärmen (Imports, Fonts)
+    zeiten = []
+    for _ in range(anzahl):
+        start = time.perf_counter()
+        funktion()
+        zeiten.append((time.perf_counter() - start) * 1000)
+    zeiten.sort()
+    print(f"{name:<28} median {statistics.median(zeiten):7.1f} ms   "
+          f"p95 {zeiten[int(len(zeiten) * 0.95) - 1]:7.1f} ms   min {zeiten[0]:7.1f} ms")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--anzahl', type=int, default=50, help='Durchläufe pro Messung')
+    parser.add_argument('--positionen', type=int, default=20, help='Rapporte pro konsolidierter Rechnung')
+    args = parser.parse_args()
+
+    rapporte = erzeuge_rapporte(args.positionen)
+    offener_rapport = dict(rapporte[1], bezahlt=False)
+
+    messe('Einzelrechnung', lambda: main.erstelle_rechnung_pdf(offener_rapport, KUNDE, 'RE-20260101-00001'),
+          args.anzahl)
+    messe(f'Konsolidiert ({args.positionen} Pos.)',
+          lambda: main.erstelle_konsolidierte_rechnung_pdf(rapporte, KUNDE, 'RE-20260101-00002'),
+          args.anzahl)
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,23 @@
+"""Gunicorn-Konfiguration für den Produktivbetrieb (Werte via Umgebungsvariablen)"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8085')}"
+
+# Mehrere Prozesse mit je mehreren Threads. SQLite erlaubt nur einen Schreiber
+# gleichzeitig; WAL-Modus und busy_timeout (app/database.py) lassen parallele
+# Schreibzugriffe warten statt fehlschlagen. Daher nur wenige Worker.
+workers = int(os.environ.get('WEB_WORKERS', 2))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+# App (inkl. init_db / Schema-Schritte) einmal im Master laden, dann forken:
+# Schema-Änderungen laufen so nicht parallel in mehreren Workern.
+preload_app = True
+
+# PDF-Rechnungen und -Exporte können länger dauern
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')